@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.utils.html import format_html
 
-from .models import Project, NodeType, RuleType, Node, NodeRule
+from .models import Project, NodeType, RuleType, Node, NodeRule, RequestProfile, ImportJob
 
 
 class NodeRuleInline(admin.TabularInline):
@@ -14,23 +15,93 @@ class NodeAdmin(admin.ModelAdmin):
     search_fields = ('content',)
     inlines = [NodeRuleInline, ]
 
+    # Изменения через админку тоже должны менять ревизию проекта, иначе клиенты получат 304 со старыми данными
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        projects = Project.objects.filter(id__in=[i for i in {form.instance.project_id, form.initial.get('project')} if i])
+        Project.bump_revisions(projects)
+        Project.update_counters(projects)
+
+    def delete_model(self, request, obj):
+        project = obj.project
+        super().delete_model(request, obj)
+        project.bump_revision()
+        Project.update_counters(Project.objects.filter(id=project.id))
+
+    def delete_queryset(self, request, queryset):
+        projects = Project.objects.filter(id__in=list(queryset.values_list('project_id', flat=True).distinct()))
+        super().delete_queryset(request, queryset)
+        Project.bump_revisions(projects)
+        Project.update_counters(projects)
+
 
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'owner',)
+    list_display = ('id', 'name', 'owner', 'node_count', 'rule_count', 'revision', 'last_modified',)
     search_fields = ('name',)
+    readonly_fields = ('node_count', 'rule_count', 'revision', 'last_modified',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change:
+            obj.bump_revision()
+
+
+class ProjectTypesAdmin(admin.ModelAdmin):
+    """Типы узлов и правил входят в ответ каждого проекта, поэтому их изменение меняет ревизию всех проектов"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Project.bump_revisions(Project.objects.all())
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Project.bump_revisions(Project.objects.all())
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        Project.bump_revisions(Project.objects.all())
 
 
-class NodeTypeAdmin(admin.ModelAdmin):
+class NodeTypeAdmin(ProjectTypesAdmin):
     list_display = ('id', 'name', 'color',)
     search_fields = ('name',)
 
 
-class RuleTypeAdmin(admin.ModelAdmin):
+class RuleTypeAdmin(ProjectTypesAdmin):
     list_display = ('id', 'name', 'code',)
     search_fields = ('name',)
 
 
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created', 'method', 'path', 'view', 'status', 'duration', 'queries', 'db_duration', 'user',)
+    list_filter = ('view',)
+    search_fields = ('path',)
+    readonly_fields = [field.name for field in RequestProfile._meta.fields if field.name != 'summary'] + ['summary_text']
+    exclude = ('summary',)
+
+    @admin.display(description='Сводка')
+    def summary_text(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', obj.summary)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'project', 'owner', 'status', 'processed_lines', 'total_lines', 'created', 'finished',)
+    list_filter = ('status',)
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(Project, ProjectAdmin)
 admin.site.register(NodeType, NodeTypeAdmin)
 admin.site.register(RuleType, RuleTypeAdmin)
 admin.site.register(Node, NodeAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
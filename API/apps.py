@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'API'
+
+    def ready(self):
+        # Подключение сигналов, сбрасывающих кеш проверенных токенов
+        import API.oauth  # noqa: F401
+        # Создание поискового индекса и триггеров после migrate
+        import API.search  # noqa: F401
+        # Профиль подключений SQLite (API_SQLITE_PRAGMAS)
+        import API.db  # noqa: F401
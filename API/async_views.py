@@ -0,0 +1,130 @@
+"""
+Асинхронные (ASGI) версии читающих представлений API.views.
+
+Под ASGI синхронное представление целиком уходит в пул потоков; эти версии работают в цикле событий
+и обращаются к базе через асинхронный ORM. Подключаются вместо синхронных настройкой API_ASYNC_VIEWS.
+"""
+import typing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+from API.changes import change_broker
+from API.db import replica_reads
+from API.http import JsonResponse
+from API.models import Project, Node
+from API.registry import types_registry
+from API.views import get_request_user, redirect_to_login, get_project_response, set_project_headers, \
+    is_stream_requested, stream_project
+
+
+def get_authenticated_user(request):
+    user = get_request_user(request)
+    return user if user.is_authenticated else None
+
+
+def async_either_login_required(func):
+    async def wrapper(request, *args, **kwargs):
+        # Проверка OAuth-токена и сессии синхронная (oauth2_provider, сессии), поэтому делается одним переходом в поток
+        user = await sync_to_async(get_authenticated_user)(request)
+        if user:
+            request.user = user
+            return await func(request, *args, **kwargs)
+        else:
+            return redirect_to_login(request)
+
+    # csrf_exempt в Django 4.2 оборачивает представление в синхронную функцию, поэтому отметка ставится здесь
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+@async_either_login_required
+@replica_reads
+async def projects(request):
+    data = {project_id: name async for project_id, name in request.user.projects.values_list('id', 'name')}
+    return JsonResponse(data)
+
+
+@async_either_login_required
+@replica_reads
+async def get_full_project_by_name(request, project_name):
+    project = await Project.objects.filter(name=project_name, owner=request.user).afirst()
+    if project:
+        return await aget_project(request, project)
+    return JsonResponse({'error': "No project found"})
+
+
+@async_either_login_required
+@replica_reads
+async def get_full_project_by_id(request, project_id):
+    project = await Project.objects.filter(id=project_id, owner=request.user).afirst()
+    if project:
+        return await aget_project(request, project)
+    return JsonResponse({'error': "No project found"})
+
+
+@async_either_login_required
+async def project_changes(request, project_id):
+    """Лента изменений проекта (text/event-stream); рассчитана на запуск через asgi.py"""
+    project = await Project.objects.filter(id=project_id, owner=request.user).afirst()
+    if not project:
+        return JsonResponse({'error': "No project found"})
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+
+    response = StreamingHttpResponse(change_broker.stream(project, last_event_id), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def aget_project(request, project: Project):
+    not_modified = get_conditional_response(
+        request, etag=project.etag, last_modified=int(project.last_modified.timestamp()))
+    if not_modified:
+        return not_modified
+
+    stream = is_stream_requested(request)
+    if stream is None:
+        threshold = getattr(settings, 'API_PROJECT_STREAM_THRESHOLD', None)
+        stream = threshold is not None and await project.nodes.acount() > threshold
+    if stream:
+        response = StreamingHttpResponse(astream_project(project), content_type='application/json')
+        return set_project_headers(response, project)
+    # Снимок - один готовый документ, читается синхронно
+    if getattr(settings, 'API_PROJECT_SNAPSHOTS', False):
+        return await sync_to_async(get_project_response)(project, False)
+
+    node_rows, rule_rows = Node.js_format_rows(project.nodes.all())
+    node_rows = [row async for row in node_rows]
+    rule_rows = [row async for row in rule_rows]
+    # Реестр читает базу синхронно, поэтому типы строк проверяются и при необходимости перечитываются до сборки
+    types = await sync_to_async(types_registry.get_covering)(
+        {row[1] for row in node_rows}, {row[1] for row in rule_rows})
+    nodes = list(Node.merge_js_format(node_rows, rule_rows, types))
+    return set_project_headers(JsonResponse(project.get_js_format(nodes=nodes, types=types)), project)
+
+
+async def astream_project(project: Project) -> typing.AsyncIterator[bytes]:
+    """
+    stream_project для ASGI: части берутся из синхронного генератора по одной. Синхронный итератор
+    StreamingHttpResponse под ASGI прочитал бы целиком (sync_to_async(list)), и проект оказался бы в памяти.
+    Все шаги идут в одном потоке (thread_sensitive), поэтому курсоры генератора остаются в своем подключении.
+    """
+    chunks = stream_project(project)
+    next_chunk = sync_to_async(next)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,234 @@
+"""
+Лента изменений проектов: Server-Sent Events для открытых в редакторе проектов.
+
+Функции записи (API.graph) после коммита публикуют событие с изменившимися и удаленными узлами проекта.
+Событие уходит в бэкенд (API_CHANGE_FEED_BACKEND), который доставляет его брокерам процессов;
+брокер раздает его подпискам - очередям открытых SSE-соединений в цикле событий ASGI.
+LocalBackend доставляет только внутри процесса; чтобы события видели все воркеры, нужен общий бэкенд (RedisBackend).
+"""
+import asyncio
+import collections
+import json
+import threading
+import typing
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+if typing.TYPE_CHECKING:
+    from API.models import Project
+
+# Сколько последних событий проекта хранить для клиентов, переподключившихся с Last-Event-ID
+HISTORY_SIZE = 50
+# Сколько недоставленных событий может накопиться у подписки, прежде чем клиенту придет reset
+QUEUE_SIZE = 100
+# Через сколько миллисекунд EventSource переподключается после обрыва
+RETRY_MS = 3000
+
+
+class ChangeEvent(typing.NamedTuple):
+    project_id: int
+    revision: int
+    text: str
+
+
+def format_event(event: str, data: dict, event_id: typing.Optional[int] = None) -> str:
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', 'data: ' + json.dumps(data, cls=DjangoJSONEncoder)]
+    return '\n'.join(lines) + '\n\n'
+
+
+# Клиент должен перечитать проект целиком: пропущенные события уже не восстановить
+RESET = format_event('reset', {})
+
+
+class Subscription:
+    """Очередь событий одного соединения; наполняется только из цикла событий, в котором создана"""
+
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.overflowed = False
+
+    def push(self, event: ChangeEvent):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= QUEUE_SIZE:
+            self.overflowed = True
+            event = None
+        self.queue.put_nowait(event)
+
+
+class ChangeBroker:
+    """Подписки и последние события проектов в пределах процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: typing.Dict[int, typing.Set[Subscription]] = {}
+        self._history: typing.Dict[int, typing.Deque[ChangeEvent]] = {}
+        self._backend = None
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                backend_class = import_string(getattr(settings, 'API_CHANGE_FEED_BACKEND', 'API.changes.LocalBackend'))
+                self._backend = backend_class(self)
+            return self._backend
+
+    def has_subscribers(self, project_id: int) -> bool:
+        return bool(self._subscriptions.get(project_id))
+
+    def publish(self, project_id: int, revision: int, data: dict):
+        self.backend.publish(ChangeEvent(project_id, revision, format_event('change', data, revision)))
+
+    def deliver(self, event: ChangeEvent):
+        """Раздает событие подпискам процесса; вызывается бэкендом из любого потока"""
+        with self._lock:
+            self._history.setdefault(event.project_id, collections.deque(maxlen=HISTORY_SIZE)).append(event)
+            subscriptions = list(self._subscriptions.get(event.project_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                self.unsubscribe(subscription)
+
+    def subscribe(self, project_id: int) -> Subscription:
+        self.backend.start()
+        subscription = Subscription(project_id)
+        with self._lock:
+            self._subscriptions.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.project_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.project_id, None)
+
+    def missed_events(self, project: 'Project', last_event_id: int) -> typing.Optional[typing.List[ChangeEvent]]:
+        """События после last_event_id до текущей ревизии проекта; None, если часть из них уже не хранится"""
+        with self._lock:
+            events = [event for event in self._history.get(project.id, ()) if event.revision > last_event_id]
+        if project.revision > last_event_id and (not events or events[0].revision != last_event_id + 1):
+            return None
+        return events
+
+    async def stream(self, project: 'Project', last_event_id: typing.Optional[int] = None) -> typing.AsyncIterator[str]:
+        """
+        Поток SSE проекта. Соединение закрывается через API_CHANGE_FEED_TIMEOUT секунд,
+        и EventSource переподключается с Last-Event-ID, не теряя событий.
+        """
+        heartbeat = getattr(settings, 'API_CHANGE_FEED_HEARTBEAT', 15)
+        timeout = getattr(settings, 'API_CHANGE_FEED_TIMEOUT', 300)
+        subscription = self.subscribe(project.id)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            last_sent = project.revision
+            if last_event_id is not None:
+                events = self.missed_events(project, last_event_id)
+                if events is None:
+                    yield RESET
+                    return
+                for event in events:
+                    yield event.text
+                    last_sent = event.revision
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    yield RESET
+                    return
+                # Событие могло уже уйти из истории, пока подписка создавалась
+                if event.revision > last_sent:
+                    yield event.text
+                    last_sent = event.revision
+        finally:
+            self.unsubscribe(subscription)
+
+
+class LocalBackend:
+    """Доставка событий только внутри процесса: подходит, когда запись и SSE обслуживает один процесс ASGI"""
+    shared = False
+
+    def __init__(self, broker: ChangeBroker):
+        self.broker = broker
+
+    def start(self):
+        pass
+
+    def publish(self, event: ChangeEvent):
+        self.broker.deliver(event)
+
+
+class RedisBackend:
+    """
+    Доставка событий всем процессам через Redis pub/sub (API_CHANGE_FEED_REDIS_URL).
+    Требует пакет redis; слушающий поток запускается при первой подписке в процессе.
+    """
+    shared = True
+    channel_prefix = 'API:changes:'
+
+    def __init__(self, broker: ChangeBroker):
+        import redis
+
+        self.broker = broker
+        self.redis = redis.Redis.from_url(getattr(settings, 'API_CHANGE_FEED_REDIS_URL', 'redis://localhost:6379/0'))
+        self._listener: typing.Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='change-feed-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.channel_prefix + '*')
+        for message in pubsub.listen():
+            project_id, revision, text = json.loads(message['data'])
+            self.broker.deliver(ChangeEvent(project_id, revision, text))
+
+    def publish(self, event: ChangeEvent):
+        self.redis.publish(f'{self.channel_prefix}{event.project_id}', json.dumps(list(event)))
+
+
+change_broker = ChangeBroker()
+
+
+def publish_changes(project: 'Project', node_ids: typing.Iterable[int] = (), deleted_ids: typing.Iterable[int] = ()):
+    """
+    Публикует после коммита событие об изменении проекта: узлы node_ids в формате Node.get_js_format
+    и id удаленных узлов deleted_ids (правила, ведущие к ним, клиент удаляет сам).
+    Событие получает id, равный новой ревизии проекта.
+    """
+    node_ids, deleted_ids = list(node_ids), list(deleted_ids)
+    project_id, revision = project.id, project.revision
+
+    def publish():
+        broker = change_broker
+        if not broker.backend.shared and not broker.has_subscribers(project_id):
+            return
+        from API.graph import nodes_js_format
+
+        broker.publish(project_id, revision, {
+            'project_id': project_id,
+            'revision': revision,
+            'nodes': nodes_js_format(node_ids),
+            'deleted': deleted_ids,
+        })
+
+    # Данные уже записаны: ошибка доставки (например, недоступен Redis) только пишется в лог
+    transaction.on_commit(publish, robust=True)
@@ -0,0 +1,125 @@
+"""
+Сжатие ответов API (gzip или deflate по Accept-Encoding).
+
+Сжимаются только JSON-ответы представлений API от API_COMPRESSION_MIN_SIZE байт, в том числе потоковые
+(get_project ?stream=1). HTML-страницы (админка, шаблоны frontend) содержат CSRF-токен рядом с данными из запроса,
+и их сжатие открывало бы атаку BREACH; файлы (FileResponse) отдаются уже сжатыми копиями (frontend.views.asset).
+Ленты событий (text/event-stream) не сжимаются, чтобы события не задерживались в буфере компрессора.
+Уровень API_COMPRESSION_LEVEL выбран по benchmarks/encoding.py: на повторяющемся JSON проектов
+низкие уровни дают почти тот же размер в несколько раз быстрее.
+"""
+import time
+import typing
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# Кодировки в порядке предпочтения при равном q и параметр wbits zlib для каждой
+CODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+COMPRESSIBLE_TYPES = ('application/json',)
+# Пакет, представления которого сжимаются
+COMPRESSED_APP = 'API'
+
+
+def parse_accept_encoding(accept_encoding: str) -> typing.Dict[str, float]:
+    """Кодировки из заголовка Accept-Encoding и их q"""
+    weights: typing.Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    return weights
+
+
+def coding_weight(weights: typing.Dict[str, float], coding: str) -> float:
+    return weights.get(coding, weights.get('*', 0.0))
+
+
+def negotiate_coding(accept_encoding: str) -> typing.Optional[str]:
+    """Кодировка из CODINGS с наибольшим q в заголовке Accept-Encoding; None, если ни одна не принимается"""
+    weights = parse_accept_encoding(accept_encoding)
+    best, best_weight = None, 0.0
+    for coding in CODINGS:
+        weight = coding_weight(weights, coding)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compressor(coding: str, level: int):
+    return zlib.compressobj(level, zlib.DEFLATED, CODINGS[coding])
+
+
+def compress_iterator(chunks: typing.Iterable[bytes], coding: str, level: int) -> typing.Iterator[bytes]:
+    compress = compressor(coding, level)
+    for chunk in chunks:
+        data = compress.compress(chunk)
+        if data:
+            yield data
+    yield compress.flush()
+
+
+async def acompress_iterator(chunks: typing.AsyncIterable[bytes], coding: str, level: int) -> typing.AsyncIterator[bytes]:
+    compress = compressor(coding, level)
+    async for chunk in chunks:
+        data = compress.compress(chunk)
+        if data:
+            yield data
+    yield compress.flush()
+
+
+def is_api_request(request) -> bool:
+    resolver_match = getattr(request, 'resolver_match', None)
+    return resolver_match is not None and resolver_match.func.__module__.split('.')[0] == COMPRESSED_APP
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if response.has_header('Content-Encoding') or not content_type.startswith(COMPRESSIBLE_TYPES) \
+                or isinstance(response, FileResponse) or not is_api_request(request):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        coding = negotiate_coding(request.headers.get('Accept-Encoding', ''))
+        if coding is None:
+            return response
+        level = getattr(settings, 'API_COMPRESSION_LEVEL', 1)
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_iterator(response.streaming_content, coding, level)
+            else:
+                response.streaming_content = compress_iterator(response.streaming_content, coding, level)
+            del response.headers['Content-Length']
+        else:
+            if len(response.content) < getattr(settings, 'API_COMPRESSION_MIN_SIZE', 1024):
+                return response
+            started = time.perf_counter()
+            compress = compressor(coding, level)
+            content = compress.compress(response.content) + compress.flush()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+            response.compress_seconds = time.perf_counter() - started
+
+        # Сжатый ответ не совпадает побайтно с исходным, поэтому ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
@@ -0,0 +1,158 @@
+"""
+Настройка подключений к базе и чтение с реплик.
+
+Профиль SQLite: на каждом новом подключении выполняются PRAGMA из API_SQLITE_PRAGMAS (WAL, busy_timeout,
+synchronous, mmap_size, cache_size). Вместе с CONN_MAX_AGE подключение и его кеш страниц переживают запрос.
+
+ReplicaRouter: запись всегда идет в default, а чтение моделей API - в одну из баз API_DB_REPLICAS, но только
+в представлениях, отмеченных replica_reads. После записи ReplicaMiddleware ставит клиенту cookie,
+и API_DB_REPLICA_PIN_SECONDS секунд его запросы читают из default, чтобы он видел свои изменения,
+пока реплика отстает. Реплику наполняет сама база; для SQLite копию default делает manage.py sync_replica.
+"""
+import contextvars
+import functools
+import random
+import typing
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+# Модели, чтение которых уходит на реплику; сессии, пользователи и токены всегда читаются из default
+REPLICA_APP_LABELS = {'API'}
+PIN_COOKIE = 'api_db_pin'
+
+
+def get_replicas() -> typing.List[str]:
+    return [alias for alias in getattr(settings, 'API_DB_REPLICAS', ()) if alias in settings.DATABASES]
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'API_SQLITE_PRAGMAS', SQLITE_PRAGMAS))
+    if connection.alias in get_replicas():
+        # Запись в реплику - ошибка маршрутизации, а не повод разойтись с default
+        pragmas['query_only'] = 1
+    # Напрямую через sqlite3, мимо execute_wrappers: эти запросы не относятся к запросу API
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+class RequestRouting:
+    __slots__ = ('replica', 'pinned', 'wrote')
+
+    def __init__(self, pinned: bool):
+        self.replica = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+current_routing = contextvars.ContextVar('api_db_routing', default=None)
+
+
+class ReplicaRouter:
+    """Вне запросов (команды, фоновые задания) и без API_DB_REPLICAS ничего не меняет"""
+
+    def db_for_read(self, model, **hints):
+        routing: typing.Optional[RequestRouting] = current_routing.get()
+        if routing is None or model._meta.app_label not in REPLICA_APP_LABELS:
+            return None
+        replicas = get_replicas()
+        if not replicas or not routing.replica or routing.pinned or routing.wrote \
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        routing: typing.Optional[RequestRouting] = current_routing.get()
+        if routing is not None and model._meta.app_label in REPLICA_APP_LABELS:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит из default вместе с данными
+        if db in get_replicas():
+            return False
+        return None
+
+
+def replica_reads(view):
+    """Разрешает представлению читать модели API с реплики"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            allow_replica_reads()
+            return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            allow_replica_reads()
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def allow_replica_reads():
+    routing: typing.Optional[RequestRouting] = current_routing.get()
+    if routing is not None:
+        routing.replica = True
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_replicas():
+            return self.get_response(request)
+        routing, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    async def __acall__(self, request):
+        if not get_replicas():
+            return await self.get_response(request)
+        routing, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    @staticmethod
+    def start(request):
+        routing = RequestRouting(pinned=PIN_COOKIE in request.COOKIES)
+        return routing, current_routing.set(routing)
+
+    @staticmethod
+    def finish(response, routing: RequestRouting):
+        if routing.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'API_DB_REPLICA_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
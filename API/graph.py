@@ -0,0 +1,640 @@
+import collections
+import re
+import typing
+
+from django.db import transaction, connection, IntegrityError
+from django.db.models import F, Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+from API.changes import publish_changes
+from API.layout import compute_layout
+from API.models import Project, Node, NodeRule, NodeType
+
+# Сколько id подставлять в один запрос "... WHERE id IN (...)" (у SQLite ограничено число параметров)
+BULK_BATCH_SIZE = 500
+
+
+def chunks(items: typing.Sequence, size: int = BULK_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def delete_by_ids(model, ids: typing.Iterable[int]) -> typing.Counter[str]:
+    """Удаляет записи пачками; возвращает число удаленных записей каждой модели, включая каскадные"""
+    ids = list(ids)
+    deleted: typing.Counter[str] = collections.Counter()
+    for batch in chunks(ids):
+        deleted.update(model.objects.filter(id__in=batch).delete()[1])
+    return deleted
+
+
+def model_count(counts: typing.Mapping[str, int], model) -> int:
+    return counts.get(model._meta.label, 0)
+
+
+def nodes_js_format(node_ids: typing.Iterable[int]) -> typing.List[dict]:
+    node_ids = list(node_ids)
+    result = []
+    for batch in chunks(node_ids):
+        result.extend(Node.bulk_js_format(Node.objects.filter(id__in=batch)))
+    return result
+
+
+def viewport_js_format(project: Project, x1: int, y1: int, x2: int, y2: int) -> dict:
+    """
+    Узлы проекта внутри прямоугольника сетки [x1, x2] x [y1, y2] с их правилами
+    и правила, пересекающие границу прямоугольника (ровно один конец внутри).
+    """
+    nodes = project.nodes.filter(y__gte=y1, y__lte=y2, x__gte=x1, x__lte=x2)
+    inside = nodes.values('id')
+    rule_codes = {rule_type.id: rule_type.code for rule_type in project.get_avalaible_rule_types()}
+
+    crossing_rules = NodeRule.objects.filter(
+        Q(node__in=inside) & ~Q(connected_node__in=inside) | Q(connected_node__in=inside) & ~Q(node__in=inside)
+    ).order_by('id').values_list('node_id', 'rule_id', 'connected_node_id')
+
+    return {
+        'nodes': Node.bulk_js_format(nodes),
+        'edges': [
+            {'node': node_id, 'rule': rule_codes[rule_id], 'connectedNode': connected_node_id}
+            for node_id, rule_id, connected_node_id in crossing_rules
+        ],
+    }
+
+
+# Направления обхода: узел правила ссылается на свой родительский узел (connected_node)
+SUBGRAPH_DIRECTIONS = {
+    'ancestors': ('node_id', 'connected_node_id'),
+    'descendants': ('connected_node_id', 'node_id'),
+}
+
+
+def reachable_nodes(project: Project, node_id: int, direction: str, depth: typing.Optional[int] = None,
+                    rule_ids: typing.Optional[typing.List[int]] = None) -> QuerySet:
+    """
+    Узлы проекта, достижимые из node_id по правилам в направлении direction (включая сам узел).
+    Обход выполняет база одним рекурсивным CTE; depth ограничивает число шагов, rule_ids - типы правил.
+    """
+    from_column, to_column = (connection.ops.quote_name(column) for column in SUBGRAPH_DIRECTIONS[direction])
+    table = connection.ops.quote_name(NodeRule._meta.db_table)
+
+    params: typing.List = [node_id]
+    conditions = []
+    if rule_ids is not None:
+        conditions.append(f"r.{connection.ops.quote_name('rule_id')} IN ({', '.join(['%s'] * len(rule_ids)) or 'NULL'})")
+        params.extend(rule_ids)
+
+    if depth is None:
+        # UNION убирает повторы, поэтому обход циклов завершается
+        sql = (
+            f"WITH RECURSIVE reachable(id) AS ("
+            f"SELECT %s UNION "
+            f"SELECT r.{to_column} FROM {table} r JOIN reachable ON r.{from_column} = reachable.id"
+            f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''}"
+            f") SELECT id FROM reachable"
+        )
+    else:
+        conditions.append('reachable.depth < %s')
+        params.append(depth)
+        sql = (
+            f"WITH RECURSIVE reachable(id, depth) AS ("
+            f"SELECT %s, 0 UNION "
+            f"SELECT r.{to_column}, reachable.depth + 1 FROM {table} r JOIN reachable ON r.{from_column} = reachable.id"
+            f" WHERE {' AND '.join(conditions)}"
+            f") SELECT id FROM reachable"
+        )
+    return project.nodes.filter(id__in=RawSQL(sql, params))
+
+
+class CloneError(Exception):
+    """Проект нельзя скопировать: имя занято или проект изменился во время копирования"""
+
+
+def clone_project(project: Project, owner, name: typing.Optional[str] = None) -> Project:
+    """
+    Копирует проект с узлами и правилами для owner внутри базы, одной транзакцией.
+    Узлы копируются INSERT ... SELECT по возрастанию id, поэтому i-й по id узел копии - копия i-го узла проекта.
+    По этому соответствию строится временная таблица old_id -> new_id, и правила копируются вторым INSERT ... SELECT.
+    Без name копия называется "<имя> (copy)", "<имя> (copy 2)" и т.д.
+    """
+    if name is None:
+        base = f"{project.name[:Project._meta.get_field('name').max_length - 12]} (copy"
+        taken = set(owner.projects.filter(name__startswith=base).values_list('name', flat=True))
+        name = next(name for name in (f"{base}{f' {i}' if i > 1 else ''})" for i in range(1, len(taken) + 2))
+                    if name not in taken)
+
+    quote = connection.ops.quote_name
+    node_table, rule_table = quote(Node._meta.db_table), quote(NodeRule._meta.db_table)
+    node_columns = ', '.join(quote(Node._meta.get_field(field).column) for field in ('content', 'node_type', 'x', 'y'))
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                clone = Project.objects.create(name=name, owner=owner)
+        except IntegrityError:
+            raise CloneError(f'Project "{name}" already exists')
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {node_table} ({node_columns}, project_id) "
+                f"SELECT {node_columns}, %s FROM {node_table} WHERE project_id = %s ORDER BY id",
+                [clone.id, project.id]
+            )
+            # Соответствие id по номерам узлов в каждом проекте. Если узлы проекта изменились между запросами,
+            # номера не совпадут, и NOT NULL откатит копирование.
+            # Таблица с первичным ключом, а не CTE: соединение с CTE база выполняет перебором всех пар
+            cursor.execute("CREATE TEMPORARY TABLE clone_node_map (old_id BIGINT NOT NULL PRIMARY KEY, "
+                           "new_id BIGINT NOT NULL)")
+            try:
+                with transaction.atomic():
+                    cursor.execute(
+                        f"INSERT INTO clone_node_map (old_id, new_id) "
+                        f"SELECT MIN(CASE WHEN project_id = %s THEN id END), MIN(CASE WHEN project_id = %s THEN id END) "
+                        f"FROM (SELECT id, project_id, ROW_NUMBER() OVER (PARTITION BY project_id ORDER BY id) AS n "
+                        f"FROM {node_table} WHERE project_id IN (%s, %s)) ranked GROUP BY n",
+                        [project.id, clone.id, project.id, clone.id]
+                    )
+            except IntegrityError:
+                raise CloneError('Project changed while cloning, try again')
+            cursor.execute(
+                f"INSERT INTO {rule_table} (node_id, rule_id, connected_node_id) "
+                f"SELECT node.new_id, rule.rule_id, connected_node.new_id FROM {rule_table} rule "
+                f"JOIN clone_node_map node ON rule.node_id = node.old_id "
+                f"JOIN clone_node_map connected_node ON rule.connected_node_id = connected_node.old_id"
+            )
+            cursor.execute("DROP TABLE clone_node_map")
+        Project.update_counters(Project.objects.filter(id=clone.id))
+
+    return clone
+
+
+def save_nodes(project: Project, saving_nodes: typing.List[dict]) -> dict:
+    """
+    Сохраняет полный список узлов проекта в формате Node.get_js_format.
+
+    Текущее состояние проекта читается одним снимком, разница с присланными узлами считается в памяти,
+    а изменения записываются bulk-операциями в одной транзакции: при ошибке проект остается нетронутым.
+    Узлы, которых нет в saving_nodes, удаляются. Возвращает сводку для ответа save_project.
+    """
+    node_types = {i.code: i.id for i in project.get_avalaible_node_types()}
+    rule_types = {i.code: i.id for i in project.get_avalaible_rule_types()}
+
+    with transaction.atomic():
+        current_nodes = {node['id']: node for node in project.nodes_json_format}
+        current_rules: typing.Dict[int, typing.Dict[int, typing.Tuple[int, int]]] = {}
+        for rule_id, node_id, rule_type_id, connected_node_id in NodeRule.objects.filter(
+                node__project=project).values_list('id', 'node_id', 'rule_id', 'connected_node_id'):
+            current_rules.setdefault(node_id, {})[connected_node_id] = (rule_id, rule_type_id)
+
+        # Узлы с нулевой позицией считаются удаленными, даже если пришли в запросе
+        kept_nodes = set()
+        modified_nodes: typing.List[typing.Tuple[Node, dict]] = []
+        created_nodes: typing.List[typing.Tuple[Node, dict]] = []
+        created_ids = set()
+
+        for node in saving_nodes:
+            node_id = int(node["id"])
+            current_node = current_nodes.get(node_id)
+            if current_node:
+                if current_node['location']['x'] == 0 or current_node['location']['y'] == 0:
+                    continue
+                kept_nodes.add(node_id)
+                if current_node != node:
+                    modified_nodes.append((Node(
+                        id=node_id,
+                        project=project,
+                        node_type_id=node_types[node["nodeType"]],
+                        content=node["content"],
+                        x=node["location"]["x"],
+                        y=node["location"]["y"],
+                    ), node))
+            elif node_id not in created_ids:
+                created_ids.add(node_id)
+                created_nodes.append((Node(
+                    project=project,
+                    node_type_id=node_types[node["nodeType"]],
+                    content=node["content"],
+                    x=node["location"]["x"],
+                    y=node["location"]["y"],
+                ), node))
+
+        nodes_for_delete = [node_id for node_id in current_nodes if node_id not in kept_nodes]
+
+        Node.objects.bulk_create([node_entity for node_entity, _ in created_nodes])
+        new_nodes: typing.Dict[int, int] = {int(node["id"]): node_entity.id for node_entity, node in created_nodes}
+
+        Node.objects.bulk_update([node_entity for node_entity, _ in modified_nodes], ['node_type', 'content', 'x', 'y'])
+
+        def resolve(node_link) -> typing.Optional[int]:
+            node_link = int(node_link)
+            if node_link in kept_nodes:
+                return node_link
+            return new_nodes.get(node_link)
+
+        rules_for_create: typing.List[NodeRule] = []
+        rules_for_update: typing.List[NodeRule] = []
+        rules_for_delete: typing.List[int] = []
+
+        for node_entity, node in modified_nodes + created_nodes:
+            wanted_rules: typing.Dict[int, int] = {}
+            for rule, nodes_links in node['rules'].items():
+                if rule not in rule_types:
+                    raise Exception('Unknown rule type')
+                for node_link in nodes_links:
+                    connected_node_id = resolve(node_link)
+                    if connected_node_id:
+                        wanted_rules[connected_node_id] = rule_types[rule]
+
+            existing_rules = current_rules.get(node_entity.id, {})
+            for connected_node_id, (rule_id, rule_type_id) in existing_rules.items():
+                if connected_node_id not in wanted_rules:
+                    rules_for_delete.append(rule_id)
+                elif wanted_rules[connected_node_id] != rule_type_id:
+                    rules_for_update.append(NodeRule(id=rule_id, rule_id=wanted_rules[connected_node_id]))
+            for connected_node_id, rule_type_id in wanted_rules.items():
+                if connected_node_id not in existing_rules:
+                    rules_for_create.append(NodeRule(
+                        node_id=node_entity.id,
+                        rule_id=rule_type_id,
+                        connected_node_id=connected_node_id
+                    ))
+
+        deleted = delete_by_ids(NodeRule, rules_for_delete)
+        NodeRule.objects.bulk_update(rules_for_update, ['rule'])
+        NodeRule.objects.bulk_create(rules_for_create)
+        deleted.update(delete_by_ids(Node, nodes_for_delete))
+
+        project.bump_revision(
+            nodes=len(created_nodes) - model_count(deleted, Node),
+            rules=len(rules_for_create) - model_count(deleted, NodeRule),
+        )
+        publish_changes(
+            project, [node_entity.id for node_entity, _ in modified_nodes + created_nodes], nodes_for_delete
+        )
+
+    return {
+        "deleted": len(nodes_for_delete),
+        "modified": len(modified_nodes),
+        "added": len(new_nodes),
+        "new_nodes_ids": new_nodes,
+    }
+
+
+class OperationError(Exception):
+    def __init__(self, message: str, index: typing.Optional[int] = None):
+        super().__init__(message)
+        # Номер операции в запросе, на которой остановилось применение
+        self.index = index
+
+
+# Обязательные поля операций: "node" - id узла (число или строка с числом), "code" - код типа,
+# "text" - строка, "location" - {"x": int, "y": int}
+OPERATION_FIELDS: typing.Dict[str, typing.Dict[str, str]] = {
+    'addNode': {'id': 'node', 'nodeType': 'code', 'location': 'location'},
+    'moveNode': {'id': 'node', 'location': 'location'},
+    'editContent': {'id': 'node', 'content': 'text'},
+    'changeType': {'id': 'node', 'nodeType': 'code'},
+    'addRule': {'id': 'node', 'connectedNode': 'node', 'rule': 'code'},
+    'changeRule': {'id': 'node', 'connectedNode': 'node', 'rule': 'code'},
+    'removeRule': {'id': 'node', 'connectedNode': 'node'},
+    'deleteNode': {'id': 'node'},
+}
+
+
+def is_valid_field(kind: str, value) -> bool:
+    if kind == 'node':
+        if isinstance(value, bool):
+            return False
+        try:
+            int(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+    if kind == 'location':
+        return isinstance(value, dict) and all(
+            isinstance(value.get(axis), int) and not isinstance(value.get(axis), bool) for axis in ('x', 'y'))
+    return isinstance(value, str)
+
+
+def validate_operations(operations: typing.List[dict]):
+    """Проверяет форму всех операций до записи; о первой неверной сообщает OperationError с ее номером"""
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise OperationError(f'Operation {index} must be an object', index)
+        fields = OPERATION_FIELDS.get(operation.get('type'))
+        if fields is None:
+            raise OperationError(f'Operation {index}: unknown operation type "{operation.get("type")}"', index)
+        for field, kind in fields.items():
+            if not is_valid_field(kind, operation.get(field)):
+                raise OperationError(f'Operation {index} ({operation["type"]}): invalid parameter "{field}"', index)
+        if 'content' in operation and not isinstance(operation['content'], str):
+            raise OperationError(f'Operation {index} ({operation["type"]}): invalid parameter "content"', index)
+
+
+def apply_operations(project: Project, operations: typing.List[dict]) -> dict:
+    """
+    Применяет к проекту упорядоченный список точечных изменений вместо полного сохранения.
+
+    Каждая операция - словарь с ключом "type" и полями в формате Node.get_js_format:
+        addNode       id, nodeType, content, location (id - временный id клиента)
+        moveNode      id, location
+        editContent   id, content
+        changeType    id, nodeType
+        addRule       id, connectedNode, rule (если связь уже есть, меняет ее тип)
+        changeRule    id, connectedNode, rule
+        removeRule    id, connectedNode
+        deleteNode    id
+    Временные id узлов, созданных addNode, можно использовать в следующих операциях того же запроса.
+    Форма всех операций проверяется до записи (validate_operations). Операции выполняются в одной транзакции;
+    при ошибке бросается OperationError с номером операции.
+    """
+    validate_operations(operations)
+    node_types = {i.code: i.id for i in project.get_avalaible_node_types()}
+    rule_types = {i.code: i.id for i in project.get_avalaible_rule_types()}
+    new_nodes: typing.Dict[int, int] = {}
+    changed_nodes: typing.Set[int] = set()
+    deleted_nodes: typing.Set[int] = set()
+    # Изменение счетчиков проекта: добавленные минус удаленные узлы и правила
+    counts: typing.Counter[str] = collections.Counter()
+
+    def node_id_of(operation: dict, key: str = 'id') -> int:
+        node_id = int(operation[key])
+        return new_nodes.get(node_id, node_id)
+
+    def code_of(operation: dict, key: str, codes: typing.Dict[str, int]) -> int:
+        if operation.get(key) not in codes:
+            raise OperationError(f'Unknown {key} "{operation.get(key)}"')
+        return codes[operation[key]]
+
+    def project_nodes(*node_ids: int):
+        nodes = project.nodes.filter(id__in=node_ids)
+        if nodes.count() != len(set(node_ids)):
+            raise OperationError('Node not found')
+        return nodes
+
+    def apply_operation(operation: dict):
+        operation_type = operation['type']
+
+        if operation_type == 'addNode':
+            node_entity = Node.objects.create(
+                project=project,
+                node_type_id=code_of(operation, 'nodeType', node_types),
+                content=operation.get('content', ''),
+                x=operation['location']['x'],
+                y=operation['location']['y'],
+            )
+            new_nodes[int(operation['id'])] = node_entity.id
+            changed_nodes.add(node_entity.id)
+            counts[Node._meta.label] += 1
+
+        elif operation_type == 'moveNode':
+            changed_nodes.add(node_id_of(operation))
+            project_nodes(node_id_of(operation)).update(
+                x=operation['location']['x'],
+                y=operation['location']['y'],
+            )
+
+        elif operation_type == 'editContent':
+            changed_nodes.add(node_id_of(operation))
+            project_nodes(node_id_of(operation)).update(content=operation['content'])
+
+        elif operation_type == 'changeType':
+            changed_nodes.add(node_id_of(operation))
+            project_nodes(node_id_of(operation)).update(node_type_id=code_of(operation, 'nodeType', node_types))
+
+        elif operation_type in ('addRule', 'changeRule'):
+            node_id, connected_node_id = node_id_of(operation), node_id_of(operation, 'connectedNode')
+            rule_id = code_of(operation, 'rule', rule_types)
+            project_nodes(node_id, connected_node_id)
+            changed_nodes.add(node_id)
+            if operation_type == 'addRule':
+                _, created = NodeRule.objects.update_or_create(
+                    node_id=node_id,
+                    connected_node_id=connected_node_id,
+                    defaults={'rule_id': rule_id}
+                )
+                counts[NodeRule._meta.label] += created
+            elif not NodeRule.objects.filter(node_id=node_id, connected_node_id=connected_node_id).update(
+                    rule_id=rule_id):
+                raise OperationError('Rule not found')
+
+        elif operation_type == 'removeRule':
+            node_id = node_id_of(operation)
+            project_nodes(node_id)
+            changed_nodes.add(node_id)
+            counts.subtract(NodeRule.objects.filter(
+                node_id=node_id, connected_node_id=node_id_of(operation, 'connectedNode')).delete()[1])
+
+        elif operation_type == 'deleteNode':
+            deleted_nodes.add(node_id_of(operation))
+            counts.subtract(project_nodes(node_id_of(operation)).delete()[1])
+
+        else:
+            raise OperationError(f'Unknown operation type "{operation_type}"')
+
+    with transaction.atomic():
+        for index, operation in enumerate(operations):
+            try:
+                apply_operation(operation)
+            except OperationError as e:
+                raise OperationError(f'Operation {index} ({operation["type"]}): {e}', index)
+
+        project.bump_revision(nodes=model_count(counts, Node), rules=model_count(counts, NodeRule))
+        publish_changes(project, changed_nodes - deleted_nodes, deleted_nodes)
+
+    return {
+        "applied": len(operations),
+        "new_nodes_ids": new_nodes,
+    }
+
+
+node_string_re = re.compile(r'(?:<([^>]+)>)?(.+)')
+
+
+def place_raw_nodes(project: Project, parent: Node, lines: typing.List[str],
+                    column: typing.Optional[int] = None) -> typing.List[int]:
+    """
+    Создает узлы из текста: каждая строка - цепочка "<тип>текст|<тип>текст|..." под узлом parent.
+
+    Цепочка i-й непустой строки идет вниз по строкам сетки со столбца column + i (по умолчанию parent.x). Если место в строке
+    сетки занято, подряд стоящие узлы справа сдвигаются на один столбец. Сдвиги считаются в памяти по
+    индексу занятости затронутых строк сетки, затем записываются одним UPDATE x = x + k на каждый
+    непрерывный диапазон, а новые узлы и правила создаются через bulk_create.
+    Возвращает id созданных и сдвинутых узлов.
+    """
+    node_types = {i.code: i for i in project.get_avalaible_node_types()}
+    default_node_type = next(iter(project.get_avalaible_node_types()), None)
+    rule = project.default_rule_type
+
+    # (тип, текст, столбец, строка сетки, индекс родителя в created_nodes или None для parent)
+    planned_nodes: typing.List[typing.Tuple[NodeType, str, int, int, typing.Optional[int]]] = []
+    x = (parent.x if column is None else column) - 1
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        last_parent, y = None, parent.y + 1
+        x += 1
+        for node_info in line.split("|"):
+            node_info = node_info.strip()
+            if not node_info:
+                continue
+            node_type, node_text = node_string_re.match(node_info).groups()
+            node_type = node_type or ""
+            planned_nodes.append((
+                node_types.get(node_type.strip(), default_node_type), node_text.strip(), x, y, last_parent
+            ))
+            last_parent, y = len(planned_nodes) - 1, y + 1
+
+    if not planned_nodes:
+        return []
+
+    with transaction.atomic():
+        rows = {y for _, _, _, y, _ in planned_nodes}
+        # Индекс занятости: строка сетки -> столбец -> ключи стоящих там узлов.
+        # Ключ существующего узла (0, id), нового - (1, индекс в planned_nodes): в таком порядке их вернула бы база
+        occupancy: typing.Dict[int, typing.Dict[int, typing.List[typing.Tuple[int, int]]]] = {y: {} for y in rows}
+        original_x: typing.Dict[int, typing.Tuple[int, int]] = {}
+        for node_id, node_x, node_y in project.nodes.filter(
+                y__gte=min(rows), y__lte=max(rows)).values_list('id', 'x', 'y'):
+            if node_y in occupancy:
+                occupancy[node_y].setdefault(node_x, []).append((0, node_id))
+                original_x[node_id] = (node_x, node_y)
+
+        final_x: typing.Dict[typing.Tuple[int, int], int] = {}
+        for index, (_, _, node_x, node_y, _) in enumerate(planned_nodes):
+            row = occupancy[node_y]
+            key = (1, index)
+            row.setdefault(node_x, []).append(key)
+            final_x[key] = node_x
+            # Конфликтующий узел сдвигается вправо, освобождая место, и так по цепочке
+            while True:
+                conflicts = [other for other in row[node_x] if other != key]
+                if not conflicts:
+                    break
+                key = min(conflicts)
+                row[node_x].remove(key)
+                node_x += 1
+                row.setdefault(node_x, []).append(key)
+                final_x[key] = node_x
+
+        shifts: typing.Dict[typing.Tuple[int, int], typing.Dict[int, int]] = {}
+        for node_id, (node_x, node_y) in original_x.items():
+            shift = final_x.get((0, node_id), node_x) - node_x
+            shifts.setdefault((node_y, node_x), {})[node_id] = shift
+
+        # Подряд идущие в строке узлы с одинаковым сдвигом сдвигаются одним запросом по диапазону столбцов.
+        # Узлы из одной клетки с разными сдвигами диапазоном не разделить, их сдвигаем по id
+        shift_ranges: typing.List[typing.List[int]] = []
+        shifts_by_id: typing.Dict[int, typing.List[int]] = {}
+        moved_nodes: typing.List[int] = []
+        previous = None
+        for (node_y, node_x), cell in sorted(shifts.items()):
+            moved_nodes.extend(node_id for node_id, shift in cell.items() if shift)
+            cell_shifts = set(cell.values())
+            if len(cell_shifts) > 1:
+                for node_id, shift in cell.items():
+                    if shift:
+                        shifts_by_id.setdefault(shift, []).append(node_id)
+                previous = None
+                continue
+            shift = cell_shifts.pop()
+            if shift:
+                if previous == (node_y, shift):
+                    shift_ranges[-1][2] = node_x
+                else:
+                    shift_ranges.append([node_y, node_x, node_x, shift])
+            previous = (node_y, shift)
+
+        # Диапазоны обрабатываются справа налево, чтобы уже сдвинутые узлы не попали в следующий диапазон
+        for node_y, from_x, to_x, shift in reversed(shift_ranges):
+            project.nodes.filter(y=node_y, x__gte=from_x, x__lte=to_x).update(x=F('x') + shift)
+        for shift, node_ids in shifts_by_id.items():
+            for batch in chunks(node_ids):
+                Node.objects.filter(id__in=batch).update(x=F('x') + shift)
+
+        created_nodes = [
+            Node(project=project, node_type=node_type, content=content, x=final_x[(1, index)], y=node_y)
+            for index, (node_type, content, _, node_y, _) in enumerate(planned_nodes)
+        ]
+        Node.objects.bulk_create(created_nodes)
+        NodeRule.objects.bulk_create([
+            NodeRule(
+                node=node_entity,
+                rule=rule,
+                connected_node=parent if planned[4] is None else created_nodes[planned[4]]
+            )
+            for node_entity, planned in zip(created_nodes, planned_nodes)
+        ])
+        project.bump_revision(nodes=len(created_nodes), rules=len(created_nodes))
+        publish_changes(project, [node_entity.id for node_entity in created_nodes] + moved_nodes)
+
+    return [node_entity.id for node_entity in created_nodes] + moved_nodes
+
+
+def free_block_offset(project: Project, own_nodes: typing.Container[int],
+                      cells: typing.List[typing.Tuple[int, int]]) -> int:
+    """Наименьший сдвиг вправо, при котором клетки cells не заняты узлами проекта, кроме own_nodes"""
+    if not cells:
+        return 0
+    rows = {y for _, y in cells}
+    occupied = {
+        (x, y) for node_id, x, y in project.nodes.filter(y__gte=min(rows), y__lte=max(rows)).values_list('id', 'x', 'y')
+        if y in rows and node_id not in own_nodes
+    }
+    if not occupied:
+        return 0
+    # Сдвиг за самый правый занятый узел точно свободен, поэтому перебор конечен
+    limit = max(x for x, _ in occupied) - min(x for x, _ in cells) + 1
+    offset = 0
+    while offset < limit and any((x + offset, y) in occupied for x, y in cells):
+        offset += 1
+    return offset
+
+
+def layout_nodes(project: Project, root: typing.Optional[Node] = None) -> typing.List[int]:
+    """
+    Раскладывает по слоям весь проект или поддерево узла root (API.layout.compute_layout).
+    Проект раскладывается от клетки (1, 1), поддерево - от текущего места root; узлы вне поддерева не двигаются,
+    а поддерево при необходимости сдвигается вправо, чтобы не встать на занятые ими клетки.
+    Новые координаты сдвинутых узлов записываются одним executemany в транзакции. Возвращает их id.
+    """
+    with transaction.atomic():
+        if root is None:
+            nodes = project.nodes.all()
+            rules = NodeRule.objects.filter(node__project=project)
+            origin_x, origin_y, root_id = 1, 1, None
+        else:
+            nodes = reachable_nodes(project, root.id, 'descendants')
+            rules = NodeRule.objects.filter(node__in=nodes.values('id'))
+            origin_x, origin_y, root_id = root.x, root.y, root.id
+
+        # Начальный порядок - текущее положение на сетке, чтобы повторная раскладка меняла как можно меньше
+        positions = {node_id: (x, y) for node_id, x, y in nodes.values_list('id', 'x', 'y')}
+        order = sorted(positions, key=lambda node_id: (node_id != root_id, positions[node_id][1],
+                                                        positions[node_id][0], node_id))
+        layout = compute_layout(order, rules.values_list('node_id', 'connected_node_id').iterator())
+
+        # Поддерево ставится правее клеток, занятых узлами вне него, целым блоком, чтобы не менять его форму;
+        # root остается на месте
+        offset = 0 if root is None else free_block_offset(project, positions, [
+            (origin_x + column, origin_y + layer) for layer, column in layout.values() if layer
+        ])
+
+        moved_nodes = []
+        for node_id, (layer, column) in layout.items():
+            x, y = origin_x + column + (offset if layer else 0), origin_y + layer
+            if positions[node_id] != (x, y):
+                moved_nodes.append((x, y, node_id))
+        if moved_nodes:
+            # Один подготовленный UPDATE на все узлы: bulk_update строит CASE по id на каждую пачку,
+            # и на десятках тысяч узлов запись занимала бы больше, чем сама раскладка
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"UPDATE {connection.ops.quote_name(Node._meta.db_table)} SET x = %s, y = %s WHERE id = %s",
+                    moved_nodes
+                )
+            project.bump_revision()
+            publish_changes(project, [node_id for _, _, node_id in moved_nodes])
+
+    return [node_id for _, _, node_id in moved_nodes]
@@ -0,0 +1,52 @@
+import json
+import time
+import typing
+
+from django import http
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость, без нее используется json из стандартной библиотеки
+    orjson = None
+
+
+def stdlib_dumps(data) -> bytes:
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def orjson_dumps(data) -> bytes:
+    """То же, что stdlib_dumps, через orjson; даты и прочие типы, которых он не знает, кодирует DjangoJSONEncoder"""
+    return orjson.dumps(data, default=DjangoJSONEncoder().default,
+                        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def json_dumps(data) -> bytes:
+    """Кодирует ответ API функцией из API_JSON_DUMPS; по умолчанию orjson, если он установлен"""
+    path = getattr(settings, 'API_JSON_DUMPS', None)
+    if path:
+        dumps: typing.Callable[[typing.Any], bytes] = import_string(path)
+    else:
+        dumps = orjson_dumps if orjson else stdlib_dumps
+    return dumps(data)
+
+
+class JsonResponse(http.JsonResponse):
+    """
+    JsonResponse, который кодирует данные через json_dumps и запоминает время кодирования (для API.metrics).
+    С нестандартным encoder или json_dumps_params кодирует как django.http.JsonResponse.
+    """
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        started = time.perf_counter()
+        if encoder is DjangoJSONEncoder and not json_dumps_params:
+            content = json_dumps(data)
+        else:
+            content = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        self.encode_seconds = time.perf_counter() - started
+        kwargs.setdefault('content_type', 'application/json')
+        http.HttpResponse.__init__(self, content=content, **kwargs)
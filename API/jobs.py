@@ -0,0 +1,112 @@
+"""
+Очередь фонового импорта текста (ImportJob) без внешнего брокера.
+
+Задание создается в базе, после коммита передается пулу потоков процесса (API_IMPORT_WORKERS)
+и выполняется тем, кто первым переведет его из очереди в работу. Задания, оставшиеся в очереди
+после перезапуска, подбирает команда run_import_jobs.
+Текст обрабатывается пачками по IMPORT_BATCH_LINES строк: каждая пачка - place_raw_nodes в своей транзакции,
+поэтому прогресс виден сразу, а при ошибке созданные раньше узлы остаются.
+"""
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from API.graph import place_raw_nodes
+from API.models import ImportJob, Node, Project
+
+IMPORT_BATCH_LINES = 500
+
+_executor: typing.Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class ImportJobError(Exception):
+    pass
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'API_IMPORT_WORKERS', 2), thread_name_prefix='import-job'
+            )
+        return _executor
+
+
+def split_lines(text: str) -> typing.List[str]:
+    return [line for line in text.split("\n") if line.strip()]
+
+
+def enqueue_import(project: Project, parent: Node, text: str, owner) -> ImportJob:
+    job = ImportJob.objects.create(
+        project=project, owner=owner, parent=parent, text=text, total_lines=len(split_lines(text))
+    )
+    transaction.on_commit(lambda: get_executor().submit(run_job_in_thread, job.id))
+    return job
+
+
+def claim_job(job_id: int) -> bool:
+    """Переводит задание из очереди в работу; False, если его уже взял другой воркер"""
+    return bool(ImportJob.objects.filter(id=job_id, status=ImportJob.QUEUED).update(
+        status=ImportJob.RUNNING, started=timezone.now()
+    ))
+
+
+def run_job(job_id: int) -> bool:
+    """Выполняет задание, если удалось его занять. Возвращает, было ли оно выполнено этим вызовом"""
+    if not claim_job(job_id):
+        return False
+    job = ImportJob.objects.select_related('project', 'parent').get(id=job_id)
+    try:
+        if job.parent is None:
+            raise ImportJobError('Active node not found')
+        lines = split_lines(job.text)
+        known = set(job.result)
+        # Задание, прерванное перезапуском, продолжается с первой необработанной пачки
+        for start in range(job.processed_lines, len(lines), IMPORT_BATCH_LINES):
+            batch = lines[start:start + IMPORT_BATCH_LINES]
+            with transaction.atomic():
+                for node_id in place_raw_nodes(job.project, job.parent, batch, job.parent.x + start):
+                    if node_id not in known:
+                        known.add(node_id)
+                        job.result.append(node_id)
+                job.processed_lines = start + len(batch)
+                job.save(update_fields=['result', 'processed_lines'])
+    except Exception as e:
+        job.status, job.error = ImportJob.FAILED, str(e) if isinstance(e, ImportJobError) else repr(e)
+    else:
+        job.status, job.text = ImportJob.DONE, ''
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'error', 'text', 'finished'])
+    return True
+
+
+def run_job_in_thread(job_id: int):
+    try:
+        run_job(job_id)
+    finally:
+        # У каждого потока пула свое соединение с базой
+        db.connection.close()
+
+
+def requeue_running_jobs() -> int:
+    """Возвращает в очередь задания, оставшиеся в работе после остановки воркеров; они продолжатся с места остановки"""
+    return ImportJob.objects.filter(status=ImportJob.RUNNING).update(status=ImportJob.QUEUED)
+
+
+def run_pending_jobs(limit: typing.Optional[int] = None) -> int:
+    """Выполняет задания из очереди по порядку создания. Возвращает число выполненных"""
+    count = 0
+    while limit is None or count < limit:
+        job_id = ImportJob.objects.filter(status=ImportJob.QUEUED).order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            break
+        if run_job(job_id):
+            count += 1
+    return count
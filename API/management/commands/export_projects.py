@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from API.models import Project
+from API.transfer import export_projects
+
+
+def export_project_file(project_id: int, path: str) -> str:
+    """Задача для процесса-воркера: один проект в отдельный файл"""
+    export_projects(Project.objects.filter(id=project_id).select_related('owner'), path)
+    return path
+
+
+class Command(BaseCommand):
+    help = 'Выгружает проекты с узлами и правилами в построчный формат API.transfer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='ID проектов')
+        parser.add_argument('--user', help='Выгрузить все проекты пользователя')
+        parser.add_argument('--output', '-o', default='-',
+                            help='Файл (*.gz - со сжатием), "-" - stdout; с --workers - каталог для файлов проектов')
+        parser.add_argument('--workers', type=int, default=1, help='Число процессов; каждый проект пишется в свой файл')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id').select_related('owner')
+        if options['project_ids']:
+            projects = projects.filter(id__in=options['project_ids'])
+        if options['user']:
+            projects = projects.filter(owner__username=options['user'])
+        if not options['project_ids'] and not options['user']:
+            raise CommandError('Set project ids or --user')
+
+        if options['workers'] <= 1:
+            count = export_projects(projects.iterator(), options['output'])
+            self.stderr.write(self.style.SUCCESS(f'Exported {count} projects'))
+            return
+
+        if options['output'] == '-':
+            raise CommandError('--workers requires --output directory')
+        os.makedirs(options['output'], exist_ok=True)
+        project_ids = list(projects.values_list('id', flat=True))
+        # Соединения с базой не должны переходить в дочерние процессы
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            paths = [os.path.join(options['output'], f'project-{project_id}.jsonl.gz') for project_id in project_ids]
+            for path in executor.map(export_project_file, project_ids, paths):
+                self.stderr.write(path)
+        self.stderr.write(self.style.SUCCESS(f'Exported {len(project_ids)} projects'))
@@ -0,0 +1,64 @@
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from API.transfer import import_projects, open_stream, TransferError
+from users.models import User
+
+
+def import_projects_file(path: str, owner_id: typing.Optional[int]) -> typing.Tuple[typing.List[str], str]:
+    """Задача для процесса-воркера: импорт одного файла. Возвращает созданные проекты и ошибку, если была"""
+    owner = User.objects.get(id=owner_id) if owner_id else None
+    created = []
+    stream = open_stream(path, 'r')
+    try:
+        for project in import_projects(stream, owner):
+            created.append(f'{project.id} {project.name}')
+    except (TransferError, KeyError, ValueError) as e:
+        return created, f'{path}: {e}'
+    finally:
+        if path != '-':
+            stream.close()
+    return created, ''
+
+
+class Command(BaseCommand):
+    help = 'Загружает проекты из файлов export_projects; каждый проект - в своей транзакции'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы (*.gz - со сжатием), "-" - stdin')
+        parser.add_argument('--owner', help='Владелец всех проектов вместо указанного в файле')
+        parser.add_argument('--workers', type=int, default=1, help='Число процессов, файлы распределяются между ними')
+
+    def handle(self, *args, **options):
+        owner_id = None
+        if options['owner']:
+            owner_id = User.objects.filter(username=options['owner']).values_list('id', flat=True).first()
+            if owner_id is None:
+                raise CommandError(f'User {options["owner"]!r} not found')
+
+        paths = options['paths']
+        if options['workers'] <= 1:
+            results = map(import_projects_file, paths, [owner_id] * len(paths))
+        else:
+            # Соединения с базой не должны переходить в дочерние процессы
+            db.connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=options['workers'])
+            results = executor.map(import_projects_file, paths, [owner_id] * len(paths))
+
+        count, errors = 0, []
+        for created, error in results:
+            for project in created:
+                self.stderr.write(project)
+            count += len(created)
+            if error:
+                errors.append(error)
+                self.stderr.write(self.style.ERROR(error))
+        if options['workers'] > 1:
+            executor.shutdown()
+
+        if errors:
+            raise CommandError(f'Imported {count} projects, {len(errors)} files failed')
+        self.stderr.write(self.style.SUCCESS(f'Imported {count} projects'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from API.graph import layout_nodes
+from API.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Раскладывает узлы проектов по слоям (API.layout), например после массового импорта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='ID проектов; по умолчанию все проекты')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['project_ids']:
+            projects = projects.filter(id__in=options['project_ids'])
+
+        count = 0
+        for project in projects.iterator():
+            moved = layout_nodes(project)
+            self.stdout.write(f'{project.id} {project.name}: moved {len(moved)} nodes')
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Laid out {count} projects'))
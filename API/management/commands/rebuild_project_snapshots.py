@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from API.models import Project, ProjectSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает снимки проектов (ProjectSnapshot), например после массового импорта или изменения типов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='ID проектов; по умолчанию все проекты')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['project_ids']:
+            projects = projects.filter(id__in=options['project_ids'])
+
+        count = 0
+        for project in projects.iterator():
+            ProjectSnapshot.rebuild(project)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} project snapshots'))
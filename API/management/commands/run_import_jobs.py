@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from API.jobs import run_pending_jobs, requeue_running_jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задания импорта текста (ImportJob) из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue', action='store_true',
+                            help='Сначала вернуть в очередь задания, оставшиеся в работе после остановки воркеров')
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Не завершаться, а проверять очередь с этим интервалом')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            self.stdout.write(f'Requeued {requeue_running_jobs()} jobs')
+
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f'Ran {count} jobs')
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
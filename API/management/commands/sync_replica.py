@@ -0,0 +1,40 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from API.db import get_replicas
+
+
+class Command(BaseCommand):
+    help = 'Копирует SQLite-базу default в реплики API_DB_REPLICAS (для проверки чтения с реплик без репликации)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Не завершаться, а повторять копирование с этим интервалом')
+
+    def handle(self, *args, **options):
+        replicas = get_replicas()
+        if not replicas:
+            raise CommandError('API_DB_REPLICAS is empty')
+        for alias in [DEFAULT_DB_ALIAS, *replicas]:
+            if settings.DATABASES[alias]['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError(f'Database {alias!r} is not SQLite')
+
+        while True:
+            for alias in replicas:
+                started = time.perf_counter()
+                # Резервное копирование SQLite: согласованный снимок default, не блокирующий запись надолго
+                source = sqlite3.connect(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'])
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    source.close()
+                    target.close()
+                self.stdout.write(f'Copied {DEFAULT_DB_ALIAS} to {alias} in {time.perf_counter() - started:.2f}s')
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from API.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает число узлов и правил проектов (Project.node_count, rule_count)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='ID проектов; по умолчанию все проекты')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['project_ids']:
+            projects = projects.filter(id__in=options['project_ids'])
+
+        count = Project.update_counters(projects)
+        self.stdout.write(self.style.SUCCESS(f'Updated counters of {count} projects'))
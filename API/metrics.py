@@ -0,0 +1,183 @@
+"""
+Метрики запросов к API: задержка, число и время SQL-запросов, время кодирования JSON и размер ответа.
+
+MetricsMiddleware собирает их для каждого запроса к представлениям API, добавляет заголовок Server-Timing
+и накапливает гистограммы в памяти процесса; API.views.metrics отдает их в текстовом формате Prometheus.
+"""
+import bisect
+import contextvars
+import threading
+import time
+import typing
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000)
+BYTES_BUCKETS = (1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+current_request = contextvars.ContextVar('api_request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics: typing.Optional[RequestMetrics] = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def on_connection_created(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: typing.Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # view -> [счетчики по корзинам (+Inf последним), сумма, количество]
+        self.values: typing.Dict[str, list] = {}
+
+    def observe(self, view: str, value: float):
+        values = self.values.get(view)
+        if values is None:
+            values = self.values[view] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        values[0][bisect.bisect_left(self.buckets, value)] += 1
+        values[1] += value
+        values[2] += 1
+
+    def render(self) -> typing.List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for view, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram(
+            'dialobild_api_request_duration_seconds', 'Время обработки запроса', LATENCY_BUCKETS)
+        self.queries = Histogram(
+            'dialobild_api_db_queries', 'Число SQL-запросов на запрос', QUERIES_BUCKETS)
+        self.db_time = Histogram(
+            'dialobild_api_db_duration_seconds', 'Суммарное время SQL-запросов на запрос', LATENCY_BUCKETS)
+        self.encode_time = Histogram(
+            'dialobild_api_json_encode_seconds', 'Время кодирования JSON ответа', LATENCY_BUCKETS)
+        self.response_size = Histogram(
+            'dialobild_api_response_bytes', 'Размер ответа после сжатия (без потоковых ответов)', BYTES_BUCKETS)
+
+    def observe(self, view: str, seconds: float, metrics: RequestMetrics,
+                encode_seconds: typing.Optional[float], size: typing.Optional[int]):
+        with self._lock:
+            self.latency.observe(view, seconds)
+            self.queries.observe(view, metrics.queries)
+            self.db_time.observe(view, metrics.db_seconds)
+            if encode_seconds is not None:
+                self.encode_time.observe(view, encode_seconds)
+            if size is not None:
+                self.response_size.observe(view, size)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for histogram in (self.latency, self.queries, self.db_time, self.encode_time, self.response_size):
+                lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+def get_view_name(request) -> typing.Optional[str]:
+    """Имя маршрута из API.urls или None для остальных запросов"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.func.__module__.startswith('API.'):
+        return None
+    return match.url_name or match.view_name
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    @staticmethod
+    def start():
+        metrics = RequestMetrics()
+        return metrics, current_request.set(metrics), time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, metrics: RequestMetrics, started: float):
+        seconds = time.perf_counter() - started
+        view = get_view_name(request)
+        if view is None:
+            return response
+
+        encode_seconds = getattr(response, 'encode_seconds', None)
+        size = None if response.streaming else len(response.content)
+        metrics_registry.observe(view, seconds, metrics, encode_seconds, size)
+
+        server_timing = [
+            f'total;dur={seconds * 1000:.1f}',
+            f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries"',
+        ]
+        if encode_seconds is not None:
+            server_timing.append(f'encode;dur={encode_seconds * 1000:.1f}')
+        compress_seconds = getattr(response, 'compress_seconds', None)
+        if compress_seconds is not None:
+            server_timing.append(f'compress;dur={compress_seconds * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(server_timing)
+        return response
@@ -3,7 +3,12 @@ import typing
 from colorfield.fields import ColorField
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
+from API.http import json_dumps
+from API.registry import types_registry, UnknownTypeError
 # from django.contrib.auth.models import User
 from users.models import User
 
@@ -23,37 +28,162 @@ class Project(models.Model):
         verbose_name='Владелец',
         related_name='projects'
     )
+    revision = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Ревизия'
+    )
+    last_modified = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Последнее изменение'
+    )
+    node_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Узлов'
+    )
+    rule_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Правил'
+    )
 
     class Meta:
         verbose_name = 'Проект'
         verbose_name_plural = 'Проекты'
 
         unique_together = ('name', 'owner')
+        indexes = [
+            # Постраничный список проектов пользователя по имени (projects/list/)
+            models.Index(fields=['owner', 'name'], name='api_project_owner_name'),
+        ]
 
     def __str__(self):
         return self.name
 
-    def get_avalaible_rule_types(self):
-        return RuleType.objects.all()
+    @staticmethod
+    def bump_revisions(projects: models.QuerySet, nodes: int = 0, rules: int = 0):
+        """
+        Отмечает изменение проектов: увеличивает ревизию, по которой строится ETag, и сдвигает счетчики
+        на число добавленных (удаленных - со знаком минус) узлов и правил, которое знает вызывающий код.
+        """
+        # Счетчики, не заполненные после добавления полей, не должны уходить в минус: запись важнее точного числа,
+        # его восстанавливает manage.py update_project_counters
+        projects.update(revision=F('revision') + 1, last_modified=timezone.now(),
+                        node_count=Greatest(F('node_count') + nodes, 0), rule_count=Greatest(F('rule_count') + rules, 0))
+
+    @staticmethod
+    def update_counters(projects: models.QuerySet):
+        """
+        Пересчитывает node_count и rule_count по всем узлам и правилам, не меняя ревизию: для копий, импорта,
+        правок в админке и manage.py update_project_counters. Запись в редакторе сдвигает счетчики в bump_revision
+        """
+        return projects.update(**Project.counters())
+
+    @staticmethod
+    def counters() -> dict:
+        def count(queryset: models.QuerySet):
+            return Coalesce(Subquery(queryset.order_by().values('c')[:1]), 0)
+
+        return {
+            'node_count': count(Node.objects.filter(project=OuterRef('pk')).values('project').annotate(c=Count('id'))),
+            'rule_count': count(NodeRule.objects.filter(node__project=OuterRef('pk')).values('node__project').annotate(
+                c=Count('id'))),
+        }
+
+    def bump_revision(self, nodes: int = 0, rules: int = 0):
+        Project.bump_revisions(Project.objects.filter(id=self.id), nodes, rules)
+        self.refresh_from_db(fields=['revision', 'last_modified', 'node_count', 'rule_count'])
+
+    @property
+    def etag(self):
+        return f'"{self.id}-{self.revision}"'
+
+    def get_avalaible_rule_types(self) -> typing.List['RuleType']:
+        return types_registry.get().rule_types
+
+    def get_avalaible_node_types(self) -> typing.List['NodeType']:
+        return types_registry.get().node_types
 
-    def get_avalaible_node_types(self):
-        return NodeType.objects.all()
+    def get_js_format(self, nodes: typing.Optional[typing.List[dict]] = None, types=None) -> dict:
+        types = types or types_registry.get()
+        return {
+            'error': 0,
+            'project_name': self.name,
+            'project_id': self.id,
+            'nodes': self.nodes_json_format if nodes is None else nodes,
+            'nodeTypes': types.node_types_json_format,
+            'ruleTypes': types.rule_types_json_format,
+            'defaultRuleType': types.default_rule_type.code
+
+        }
 
     @property
     def nodes_json_format(self):
-        return list(map(lambda node: node.get_js_format(), self.nodes.all()))
+        return Node.bulk_js_format(self.nodes.all())
 
     @property
     def node_types_json_format(self):
-        return list(map(lambda node_type: node_type.get_js_format(), self.get_avalaible_node_types()))
+        return types_registry.get().node_types_json_format
 
     @property
     def rule_types_json_format(self):
-        return list(map(lambda rule_type: rule_type.get_js_format(), self.get_avalaible_rule_types()))
+        return types_registry.get().rule_types_json_format
 
     @property
     def default_rule_type(self):
-        return RuleType.objects.filter(code='mustHave').first()
+        return types_registry.get().default_rule_type
+
+
+class ProjectSnapshot(models.Model):
+    """
+    Готовый ответ get_project для проекта, закодированный в JSON.
+    Актуален, пока revision совпадает с ревизией проекта, а types_version - с версией реестра типов;
+    иначе пересобирается при следующем чтении.
+    """
+    project = models.OneToOneField(
+        Project,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Проект',
+        related_name='snapshot'
+    )
+    revision = models.PositiveIntegerField(
+        verbose_name='Ревизия проекта'
+    )
+    # Ревизия меняется в транзакции изменения типов, а реестр - после ее коммита; снимок, собранный
+    # между ними, иначе остался бы со старыми типами до следующего изменения проекта
+    types_version = models.CharField(
+        max_length=32,
+        default='',
+        verbose_name='Версия типов'
+    )
+    data = models.BinaryField(
+        verbose_name='Данные'
+    )
+
+    class Meta:
+        verbose_name = 'Снимок проекта'
+        verbose_name_plural = 'Снимки проектов'
+
+    def __str__(self):
+        return f"{self.project} ({self.revision})"
+
+    @classmethod
+    def rebuild(cls, project: Project) -> bytes:
+        types = types_registry.get()
+        data = json_dumps(project.get_js_format(types=types))
+        cls.objects.update_or_create(project=project, defaults={
+            'revision': project.revision, 'types_version': types.version, 'data': data
+        })
+        return data
+
+    @classmethod
+    def get_data(cls, project: Project) -> bytes:
+        snapshot = cls.objects.filter(
+            project=project, revision=project.revision, types_version=types_registry.get().version
+        ).values_list('data', flat=True).first()
+        if snapshot is None:
+            return cls.rebuild(project)
+        return bytes(snapshot)
+
 
 class NodeType(models.Model):
     id = models.AutoField(
@@ -179,6 +309,11 @@ class Node(models.Model):
         verbose_name = 'Узел'
         verbose_name_plural = 'Узлы'
 
+        indexes = [
+            # Выборка узлов проекта по прямоугольнику сетки (project/id/<id>/viewport/)
+            models.Index(fields=['project', 'y', 'x'], name='api_node_project_y_x'),
+        ]
+
     def __str__(self):
         return self.content[:50] + '...' if len(self.content) > 50 else self.content
 
@@ -203,6 +338,76 @@ class Node(models.Model):
     def location(self):
         return {'x': self.x, 'y': self.y}
 
+    @classmethod
+    def bulk_js_format(cls, nodes: models.QuerySet) -> typing.List[dict]:
+        """
+        То же, что get_js_format для каждого узла из nodes, но за фиксированное число запросов:
+        узлы и правила выбираются одним запросом каждый и собираются в памяти.
+        """
+        return list(cls.iter_js_format(nodes))
+
+    @classmethod
+    def iter_js_format(cls, nodes: models.QuerySet, chunk_size: int = 2000) -> typing.Iterator[dict]:
+        """
+        Отдает узлы в формате get_js_format по одному, не загружая проект целиком.
+        Узлы и правила читаются двумя курсорами, упорядоченными по id узла, и сливаются на ходу.
+        """
+        node_rows, rule_rows = cls.js_format_rows(nodes)
+        return cls.merge_js_format(
+            node_rows.iterator(chunk_size=chunk_size), rule_rows.iterator(chunk_size=chunk_size), types_registry.get(),
+            types_registry.reload
+        )
+
+    @staticmethod
+    def js_format_rows(nodes: models.QuerySet) -> typing.Tuple[models.QuerySet, models.QuerySet]:
+        """Запросы строк узлов и их правил для merge_js_format"""
+        node_rows = nodes.order_by('id').values_list('id', 'node_type_id', 'content', 'x', 'y')
+        rule_rows = NodeRule.objects.filter(node__in=nodes.values('id')).order_by('node_id', 'id').values_list(
+            'node_id', 'rule_id', 'connected_node_id')
+        return node_rows, rule_rows
+
+    @staticmethod
+    def merge_js_format(node_rows: typing.Iterable, rule_rows: typing.Iterable, types,
+                        reload_types: typing.Optional[typing.Callable] = None) -> typing.Iterator[dict]:
+        """
+        Собирает узлы из строк js_format_rows. Сама к базе не обращается: если тип узла или правила
+        не найден в types, вызывается reload_types(types) (например, types_registry.reload), а без него -
+        UnknownTypeError. Асинхронный код проверяет типы заранее (types_registry.get_covering).
+        """
+        rule_codes: typing.Dict[int, str] = {rule_type.id: rule_type.code for rule_type in types.rule_types}
+        node_type_codes: typing.Dict[int, str] = {node_type.id: node_type.code for node_type in types.node_types}
+
+        def update_types():
+            # Тип создан в другом процессе, а реестр этого еще не перечитан
+            nonlocal types, rule_codes, node_type_codes
+            if reload_types is None:
+                raise UnknownTypeError('Node or rule type is not loaded')
+            types = reload_types(types)
+            rule_codes = {rule_type.id: rule_type.code for rule_type in types.rule_types}
+            node_type_codes = {node_type.id: node_type.code for node_type in types.node_types}
+
+        rule_rows = iter(rule_rows)
+        node_rule = next(rule_rows, None)
+        for node_id, node_type_id, content, x, y in node_rows:
+            node_rules = []
+            while node_rule and node_rule[0] <= node_id:
+                if node_rule[0] == node_id:
+                    node_rules.append(node_rule)
+                node_rule = next(rule_rows, None)
+            if node_type_id not in node_type_codes or any(rule[1] not in rule_codes for rule in node_rules):
+                update_types()
+
+            rules = {code: [] for code in rule_codes.values()}
+            for _, rule_id, connected_node_id in node_rules:
+                rules[rule_codes[rule_id]].append(connected_node_id)
+            yield {
+                'nodeType': node_type_codes[node_type_id],
+                'content': content,
+                'location': {'x': x, 'y': y},
+                'id': node_id,
+                'rules': rules,
+            }
+
 
 class NodeRule(models.Model):
     node = models.ForeignKey(
@@ -228,7 +433,148 @@ class NodeRule(models.Model):
         verbose_name = 'Правило в узле'
         verbose_name_plural = 'Правила в узлах'
 
+        # Шаги обхода графа (API.graph.reachable_nodes) идут по этому индексу и индексу connected_node
         unique_together = ('node', 'connected_node')
 
     def __str__(self):
         return f"{self.node} - {self.rule} - {self.connected_node}"
+
+
+class RequestProfile(models.Model):
+    """Профиль одного запроса, снятый API.profiling.ProfilerMiddleware; файлы лежат в API_PROFILES_DIR"""
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создан'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Пользователь',
+        related_name='request_profiles'
+    )
+    method = models.CharField(
+        max_length=10,
+        verbose_name='Метод'
+    )
+    path = models.CharField(
+        max_length=2048,
+        verbose_name='Адрес'
+    )
+    view = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name='Представление'
+    )
+    status = models.PositiveSmallIntegerField(
+        verbose_name='Код ответа'
+    )
+    duration = models.FloatField(
+        verbose_name='Длительность, с'
+    )
+    queries = models.PositiveIntegerField(
+        verbose_name='SQL-запросов'
+    )
+    db_duration = models.FloatField(
+        verbose_name='Время SQL, с'
+    )
+    profile_file = models.CharField(
+        max_length=100,
+        verbose_name='Файлы профиля'
+    )
+    summary = models.TextField(
+        verbose_name='Сводка'
+    )
+
+    class Meta:
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration:.3f} с)"
+
+
+class ImportJob(models.Model):
+    """Фоновый импорт текста в проект (add_raw_nodes с "async": true), выполняется воркерами API.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        verbose_name='Проект',
+        related_name='import_jobs'
+    )
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Владелец',
+        related_name='import_jobs'
+    )
+    parent = models.ForeignKey(
+        Node,
+        on_delete=models.SET_NULL,
+        null=True,
+        verbose_name='Родительский узел',
+        related_name='+'
+    )
+    text = models.TextField(
+        verbose_name='Текст'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Статус'
+    )
+    total_lines = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Строк'
+    )
+    processed_lines = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Обработано строк'
+    )
+    result = models.JSONField(
+        default=list,
+        verbose_name='Созданные и сдвинутые узлы'
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создан'
+    )
+    started = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Начат'
+    )
+    finished = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Завершен'
+    )
+
+    class Meta:
+        verbose_name = 'Импорт текста'
+        verbose_name_plural = 'Импорт текста'
+        indexes = [
+            # Выборка очереди воркерами
+            models.Index(fields=['status', 'id'], name='api_importjob_status_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.project} #{self.id} ({self.status})"
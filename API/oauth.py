@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from oauth2_provider.oauth2_backends import get_oauthlib_core
+from oauth2_provider.settings import oauth2_settings
+
+from users.models import User
+
+
+class TokenOwner(typing.NamedTuple):
+    user: User
+    scopes: typing.List[str]
+    deadline: float
+
+
+class TokenCache:
+    """
+    Кеш проверенных OAuth-токенов в памяти процесса: sha256 токена -> владелец и scopes.
+    Запись живет не дольше ttl секунд и не дольше срока действия самого токена; при переполнении
+    вытесняются давно не использованные записи. Отозванные токены удаляются сигналами модели AccessToken,
+    в других процессах они перестают действовать не позже чем через ttl.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: typing.OrderedDict[str, TokenOwner] = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> typing.Optional[TokenOwner]:
+        key = self.key(token)
+        with self._lock:
+            owner = self._entries.get(key)
+            if owner is None:
+                return None
+            if owner.deadline <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return owner
+
+    def set(self, token: str, access_token) -> TokenOwner:
+        owner = TokenOwner(
+            user=access_token.user,
+            scopes=list(access_token.scopes),
+            deadline=min(time.time() + self.ttl, access_token.expires.timestamp()),
+        )
+        if self.ttl <= 0:
+            return owner
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = owner
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return owner
+
+    def discard(self, token: str):
+        with self._lock:
+            self._entries.pop(self.key(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    ttl=getattr(settings, 'API_TOKEN_CACHE_TTL', 60),
+    max_size=getattr(settings, 'API_TOKEN_CACHE_SIZE', 10000),
+)
+
+
+def get_bearer_token(request) -> typing.Optional[str]:
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    auth_type, _, token = authorization.partition(' ')
+    if auth_type.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def get_token_owner(request) -> typing.Optional[TokenOwner]:
+    """Владелец Bearer-токена запроса: из кеша или после проверки через oauth2_provider"""
+    token = get_bearer_token(request)
+    if not token:
+        return None
+
+    owner = token_cache.get(token)
+    if owner:
+        return owner
+
+    valid, oauthlib_request = get_oauthlib_core().verify_request(request, scopes=[])
+    access_token = getattr(oauthlib_request, 'access_token', None)
+    if not valid or not access_token or not isinstance(access_token.user, User):
+        return None
+    return token_cache.set(token, access_token)
+
+
+@receiver(post_save, sender=oauth2_settings.ACCESS_TOKEN_MODEL)
+@receiver(post_delete, sender=oauth2_settings.ACCESS_TOKEN_MODEL)
+def discard_cached_token(sender, instance, **kwargs):
+    # Отзыв токена в oauth2_provider - это удаление AccessToken; при изменении (срок, scopes) запись тоже сбрасывается
+    token_cache.discard(instance.token)
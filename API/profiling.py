@@ -0,0 +1,128 @@
+"""
+Профилирование отдельного запроса по требованию.
+
+Запрос сотрудника (is_staff) с заголовком "X-Profile: 1" или параметром ?profile=1 выполняется под cProfile,
+все SQL-запросы записываются. В каталог API_PROFILES_DIR сохраняются профиль (.prof, для pstats/snakeviz)
+и сводка запросов (.queries.json), а в базу - запись RequestProfile, которая видна в админке.
+Профилируется поток, обрабатывающий запрос, поэтому асинхронные представления под ASGI видны не полностью.
+"""
+import cProfile
+import io
+import json
+import pstats
+import time
+import typing
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async, async_to_sync
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from API.models import RequestProfile
+from API.views import get_request_user
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+TOP_FUNCTIONS = 40
+TOP_QUERIES = 40
+
+
+def is_profile_requested(request) -> bool:
+    return request.META.get(PROFILE_HEADER, request.GET.get('profile', '0')) not in ('', '0', 'false')
+
+
+def rank_queries(queries: typing.List[typing.Tuple[str, float]]) -> typing.List[dict]:
+    """Запросы, сгруппированные по тексту SQL (параметры в нем уже вынесены), по убыванию общего времени"""
+    grouped: typing.Dict[str, dict] = {}
+    for sql, seconds in queries:
+        entry = grouped.setdefault(sql, {'sql': sql, 'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+    return sorted(grouped.values(), key=lambda entry: entry['seconds'], reverse=True)
+
+
+class ProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_profile_requested(request):
+            return self.get_response(request)
+        return self.profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        # В поток уходят только профилируемые запросы, остальные остаются в цикле событий
+        if not is_profile_requested(request):
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, async_to_sync(self.get_response))
+
+    def profile(self, request, get_response):
+        user = get_request_user(request)
+        if not user.is_staff:
+            return get_response(request)
+
+        queries: typing.List[typing.Tuple[str, float]] = []
+
+        def record_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, time.perf_counter() - started))
+
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record_query))
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+
+        profile = self.save(request, user, response, profiler, queries, duration)
+        response.headers['X-Profile-Id'] = str(profile.id)
+        return response
+
+    @staticmethod
+    def save(request, user, response, profiler: cProfile.Profile,
+             queries: typing.List[typing.Tuple[str, float]], duration: float) -> RequestProfile:
+        directory = Path(getattr(settings, 'API_PROFILES_DIR', Path(settings.BASE_DIR) / 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+        profiler.dump_stats(directory / f'{name}.prof')
+        ranked_queries = rank_queries(queries)
+        with open(directory / f'{name}.queries.json', 'w', encoding='utf-8') as file:
+            json.dump(ranked_queries, file, ensure_ascii=False, indent=2)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        summary.write('\nSQL (по общему времени):\n')
+        for entry in ranked_queries[:TOP_QUERIES]:
+            summary.write(f"{entry['seconds'] * 1000:10.1f} ms {entry['count']:6}x  {entry['sql']}\n")
+
+        match = getattr(request, 'resolver_match', None)
+        return RequestProfile.objects.create(
+            user=user if user.is_authenticated else None,
+            method=request.method,
+            path=request.get_full_path()[:2048],
+            view=(match.view_name if match else '')[:200],
+            status=response.status_code,
+            duration=duration,
+            queries=len(queries),
+            db_duration=sum(seconds for _, seconds in queries),
+            profile_file=name,
+            summary=summary.getvalue(),
+        )
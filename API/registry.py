@@ -0,0 +1,100 @@
+import threading
+import typing
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+if typing.TYPE_CHECKING:
+    from API.models import NodeType, RuleType
+
+# Ключ в общем кеше с текущей версией типов. Процессы сверяют с ним свою копию реестра,
+# поэтому для согласованности нескольких воркеров CACHES должен быть общим (redis, memcached, БД)
+VERSION_CACHE_KEY = 'API:types-version'
+
+
+class UnknownTypeError(LookupError):
+    pass
+
+
+class Types(typing.NamedTuple):
+    version: str
+    node_types: typing.List['NodeType']
+    rule_types: typing.List['RuleType']
+    node_types_json_format: typing.List[dict]
+    rule_types_json_format: typing.List[dict]
+    default_rule_type: typing.Optional['RuleType']
+
+    def covers(self, node_type_ids: typing.Iterable[int], rule_type_ids: typing.Iterable[int]) -> bool:
+        return set(node_type_ids) <= {node_type.id for node_type in self.node_types} \
+            and set(rule_type_ids) <= {rule_type.id for rule_type in self.rule_types}
+
+
+class TypeRegistry:
+    """
+    Копия таблиц NodeType и RuleType в памяти процесса.
+    Перечитывается, когда версия в общем кеше отличается от загруженной.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types: typing.Optional[Types] = None
+
+    def get(self) -> Types:
+        types = self._types
+        version = cache.get(VERSION_CACHE_KEY)
+        if types is None or version is None or types.version != version:
+            with self._lock:
+                types = self._load()
+        return types
+
+    def get_covering(self, node_type_ids: typing.Iterable[int], rule_type_ids: typing.Iterable[int]) -> Types:
+        """Типы, среди которых есть все указанные id; если какого-то нет, реестр перечитывается (reload)"""
+        types = self.get()
+        if not types.covers(node_type_ids, rule_type_ids):
+            types = self.reload(types)
+        return types
+
+    def reload(self, loaded: Types) -> Types:
+        """
+        Перечитывает типы, если копия loaded встретила неизвестный id. Так процесс видит тип, созданный другим
+        воркером, даже когда версия в кеше до него не дошла (кеш не общий или запись устарела)
+        """
+        with self._lock:
+            if self._types is None or self._types is loaded:
+                return self._load()
+            return self._types
+
+    def invalidate(self):
+        cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        self._types = None
+
+    def _load(self) -> Types:
+        from API.models import NodeType, RuleType
+
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+        node_types = list(NodeType.objects.order_by('id'))
+        rule_types = list(RuleType.objects.order_by('id'))
+        self._types = Types(
+            version=version,
+            node_types=node_types,
+            rule_types=rule_types,
+            node_types_json_format=[node_type.get_js_format() for node_type in node_types],
+            rule_types_json_format=[rule_type.get_js_format() for rule_type in rule_types],
+            default_rule_type=next((rule_type for rule_type in rule_types if rule_type.code == 'mustHave'), None),
+        )
+        return self._types
+
+
+types_registry = TypeRegistry()
+
+
+@receiver(post_save, sender='API.NodeType')
+@receiver(post_delete, sender='API.NodeType')
+@receiver(post_save, sender='API.RuleType')
+@receiver(post_delete, sender='API.RuleType')
+def invalidate_types_registry(sender, **kwargs):
+    transaction.on_commit(types_registry.invalidate)
@@ -0,0 +1,135 @@
+"""
+Полнотекстовый поиск по содержимому узлов.
+
+SQLite: виртуальная таблица FTS5 над API_node (external content), которую синхронизируют триггеры на вставку,
+изменение и удаление узлов, поэтому в индекс попадают и bulk_create/bulk_update, и сырые UPDATE.
+PostgreSQL: GIN-индекс по to_tsvector(content), который база обновляет сама.
+Индекс и триггеры создаются после migrate (сигнал post_migrate) и пересобираются командой rebuild_search_index.
+"""
+import html
+import re
+import typing
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from API.models import Node, Project
+
+SEARCH_TABLE = 'api_node_search'
+# Конфигурация текстового поиска PostgreSQL: без стемминга, как unicode61 в SQLite
+SEARCH_CONFIG = 'simple'
+SEARCH_LIMIT = 50
+SNIPPET_WORDS = 12
+
+# Границы подсветки внутри базы; в ответе заменяются на <mark> после экранирования HTML
+START_MARK, STOP_MARK = '\x02', '\x03'
+search_term_re = re.compile(r'\w+')
+
+
+def install_search_index(using: str = DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    node_table = quote(Node._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+            created = cursor.fetchone() is None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                f"content, content={node_table}, content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON {node_table} BEGIN "
+                f"INSERT INTO {SEARCH_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {node_table} BEGIN "
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF content ON {node_table} BEGIN "
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+                f"INSERT INTO {SEARCH_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            )
+            if created:
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE} ON {node_table} "
+                f"USING GIN (to_tsvector('{SEARCH_CONFIG}', content))"
+            )
+
+
+def rebuild_search_index(using: str = DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    install_search_index(using)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f"REINDEX INDEX {SEARCH_TABLE}")
+
+
+@receiver(post_migrate)
+def install_search_index_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'API':
+        install_search_index(using)
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>')
+
+
+def search_nodes(owner, query: str, project_id: typing.Optional[int] = None,
+                 limit: int = SEARCH_LIMIT) -> typing.List[dict]:
+    """
+    Узлы проектов owner, содержащие все слова query (последнее - как префикс), по убыванию релевантности.
+    Фрагмент текста с подсветкой совпадений (<mark>) считается только для возвращаемых строк.
+    """
+    terms = search_term_re.findall(query)
+    if not terms:
+        return []
+
+    connection = connections[Node.objects.db]
+    quote = connection.ops.quote_name
+    node_table, project_table = quote(Node._meta.db_table), quote(Project._meta.db_table)
+    project_filter = 'AND n.project_id = %s' if project_id is not None else ''
+    project_params = [project_id] if project_id is not None else []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Слова в кавычках: синтаксис FTS5 (OR, NEAR, скобки) из пользовательского ввода не применяется
+            match = ' '.join(f'"{term}"' for term in terms) + '*'
+            cursor.execute(
+                f"SELECT n.id, n.project_id, p.name, "
+                f"snippet({SEARCH_TABLE}, 0, %s, %s, '…', {SNIPPET_WORDS}), -bm25({SEARCH_TABLE}) AS rank "
+                f"FROM {SEARCH_TABLE} JOIN {node_table} n ON n.id = {SEARCH_TABLE}.rowid "
+                f"JOIN {project_table} p ON p.id = n.project_id "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND p.owner_id = %s {project_filter} "
+                f"ORDER BY rank DESC, n.id LIMIT %s",
+                [START_MARK, STOP_MARK, match, owner.id, *project_params, limit]
+            )
+        elif connection.vendor == 'postgresql':
+            tsquery = ' & '.join(term.lower() for term in terms) + ':*'
+            cursor.execute(
+                f"SELECT found.id, found.project_id, found.name, "
+                f"ts_headline('{SEARCH_CONFIG}', found.content, to_tsquery('{SEARCH_CONFIG}', %s), %s), found.rank "
+                f"FROM (SELECT n.id, n.project_id, p.name, n.content, "
+                f"ts_rank(to_tsvector('{SEARCH_CONFIG}', n.content), to_tsquery('{SEARCH_CONFIG}', %s)) AS rank "
+                f"FROM {node_table} n JOIN {project_table} p ON p.id = n.project_id "
+                f"WHERE to_tsvector('{SEARCH_CONFIG}', n.content) @@ to_tsquery('{SEARCH_CONFIG}', %s) "
+                f"AND p.owner_id = %s {project_filter} ORDER BY rank DESC, n.id LIMIT %s) found "
+                f"ORDER BY found.rank DESC, found.id",
+                [tsquery, f'StartSel={START_MARK}, StopSel={STOP_MARK}, MaxWords={SNIPPET_WORDS}, MinWords=3',
+                 tsquery, tsquery, owner.id, *project_params, limit]
+            )
+        else:
+            raise NotImplementedError(f'Full-text search is not supported for {connection.vendor}')
+        rows = cursor.fetchall()
+
+    return [
+        {'project_id': node_project_id, 'project_name': name, 'node_id': node_id, 'snippet': highlight(snippet),
+         'rank': rank}
+        for node_id, node_project_id, name, snippet, rank in rows
+    ]
@@ -1 +1,799 @@
-# Create your tests here.
+import gzip
+import json
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from API.async_views import aget_project
+from API.changes import change_broker, LocalBackend
+from API.db import ReplicaRouter, ReplicaMiddleware, replica_reads, PIN_COOKIE
+from API.graph import save_nodes, place_raw_nodes, clone_project, node_string_re
+from API.http import json_dumps
+from API.jobs import run_job
+from API.models import Project, Node, NodeRule, NodeType, RuleType, ImportJob, ProjectSnapshot
+from API.oauth import token_cache
+from API.registry import types_registry, UnknownTypeError
+from API.transfer import iter_project_lines, import_projects, TransferError
+from API.views import encode_cursor
+from users.models import User
+
+
+class GraphTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='password')
+        self.reply = NodeType.objects.create(name='Ответ', code='reply', color='#ffffff')
+        self.question = NodeType.objects.create(name='Вопрос', code='question', color='#000000')
+        self.must_have = RuleType.objects.create(name='Обязательно', code='mustHave')
+        self.never = RuleType.objects.create(name='Никогда', code='never')
+        # Типы создаются в откатываемой транзакции теста, on_commit реестра не сработает
+        types_registry.invalidate()
+        self.project = Project.objects.create(name='project', owner=self.user)
+        self.client.force_login(self.user)
+
+    def create_node(self, content: str, x: int, y: int, parent: Node = None) -> Node:
+        node = Node.objects.create(project=self.project, node_type=self.reply, content=content, x=x, y=y)
+        if parent:
+            NodeRule.objects.create(node=node, rule=self.must_have, connected_node=parent)
+        return node
+
+    def project_nodes(self) -> dict:
+        return {node['id']: node for node in self.project.nodes_json_format}
+
+
+class SaveNodesTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        self.child = self.create_node('child', 1, 2, self.root)
+        self.other = self.create_node('other', 2, 2, self.root)
+        Project.update_counters(Project.objects.filter(id=self.project.id))
+
+    def test_updates_only_changed_nodes(self):
+        nodes = self.project_nodes()
+        nodes[self.child.id]['content'] = 'changed'
+        nodes[self.other.id]['rules'] = {'mustHave': [], 'never': [self.root.id]}
+
+        summary = save_nodes(self.project, list(nodes.values()))
+
+        self.assertEqual((summary['modified'], summary['added'], summary['deleted']), (2, 0, 0))
+        self.assertEqual(Node.objects.get(id=self.child.id).content, 'changed')
+        self.assertEqual(NodeRule.objects.get(node=self.other).rule, self.never)
+        self.assertEqual(self.project_nodes(), nodes)
+
+    def test_deletes_missing_nodes_with_their_rules(self):
+        nodes = self.project_nodes()
+        del nodes[self.child.id]
+
+        summary = save_nodes(self.project, list(nodes.values()))
+
+        self.assertEqual(summary['deleted'], 1)
+        self.assertFalse(Node.objects.filter(id=self.child.id).exists())
+        self.assertFalse(NodeRule.objects.filter(node_id=self.child.id).exists())
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.node_count, self.project.rule_count), (2, 1))
+
+    def test_resolves_links_between_new_nodes(self):
+        nodes = list(self.project_nodes().values()) + [
+            {'id': -1, 'nodeType': 'question', 'content': 'new parent', 'location': {'x': 3, 'y': 2},
+             'rules': {'mustHave': [self.root.id]}},
+            {'id': -2, 'nodeType': 'reply', 'content': 'new child', 'location': {'x': 3, 'y': 3},
+             'rules': {'mustHave': [-1]}},
+        ]
+
+        summary = save_nodes(self.project, nodes)
+
+        new_parent, new_child = summary['new_nodes_ids'][-1], summary['new_nodes_ids'][-2]
+        self.assertEqual(NodeRule.objects.get(node_id=new_parent).connected_node_id, self.root.id)
+        self.assertEqual(NodeRule.objects.get(node_id=new_child).connected_node_id, new_parent)
+
+    def test_changes_revision(self):
+        revision = self.project.revision
+        save_nodes(self.project, list(self.project_nodes().values()))
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.revision, revision + 1)
+
+
+class OperationsTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+
+    def post_operations(self, operations: list):
+        return self.client.post('/api/project/save_operations/', json.dumps({
+            'project_id': self.project.id, 'operations': operations
+        }), content_type='application/json')
+
+    def test_applies_operations_with_temporary_ids(self):
+        response = self.post_operations([
+            {'type': 'addNode', 'id': -1, 'nodeType': 'reply', 'content': 'new', 'location': {'x': 1, 'y': 2}},
+            {'type': 'addRule', 'id': -1, 'connectedNode': self.root.id, 'rule': 'mustHave'},
+            {'type': 'editContent', 'id': self.root.id, 'content': 'edited'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        new_id = json.loads(response.content)['new_nodes_ids']['-1']
+        self.assertEqual(NodeRule.objects.get(node_id=new_id).connected_node_id, self.root.id)
+        self.assertEqual(Node.objects.get(id=self.root.id).content, 'edited')
+
+    def test_rejects_malformed_operation(self):
+        for operation in [
+            {'type': 'moveNode', 'id': self.root.id},
+            {'type': 'moveNode', 'id': self.root.id, 'location': {'x': '1', 'y': 1}},
+            {'type': 'editContent', 'id': 'abc', 'content': 'text'},
+            {'type': 'unknown', 'id': self.root.id},
+        ]:
+            with self.subTest(operation=operation):
+                response = self.post_operations([
+                    {'type': 'editContent', 'id': self.root.id, 'content': 'edited'}, operation
+                ])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content)['operation'], 1)
+                self.assertEqual(Node.objects.get(id=self.root.id).content, 'root')
+
+    def test_rolls_back_batch_on_error(self):
+        response = self.post_operations([
+            {'type': 'editContent', 'id': self.root.id, 'content': 'edited'},
+            {'type': 'deleteNode', 'id': self.root.id + 1000},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['operation'], 1)
+        self.assertEqual(Node.objects.get(id=self.root.id).content, 'root')
+
+    def test_other_users_project_not_found(self):
+        self.client.force_login(User.objects.create_user('other', password='password'))
+
+        response = self.post_operations([{'type': 'editContent', 'id': self.root.id, 'content': 'edited'}])
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Node.objects.get(id=self.root.id).content, 'root')
+
+
+def place_raw_nodes_per_line(project: Project, parent: Node, lines: list):
+    """Прежний алгоритм add_raw_nodes: узел за узлом, со сдвигом конфликтующих узлов отдельными запросами"""
+    node_types = project.get_avalaible_node_types()
+
+    def move_conflicts(node: Node):
+        conflict = project.nodes.filter(y=node.y, x=node.x).exclude(id=node.id).order_by('id').first()
+        if conflict:
+            conflict.x += 1
+            conflict.save()
+            move_conflicts(conflict)
+
+    x = parent.x - 1
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        last_parent = parent
+        x += 1
+        for node_info in line.split('|'):
+            node_info = node_info.strip()
+            if not node_info:
+                continue
+            node_type, node_text = node_string_re.match(node_info).groups()
+            node_type = next((i for i in node_types if i.code == (node_type or '').strip()), node_types[0])
+            node = Node.objects.create(project=project, content=node_text.strip(), node_type=node_type,
+                                       x=x, y=last_parent.y + 1)
+            move_conflicts(node)
+            NodeRule.objects.create(node=node, rule=project.default_rule_type, connected_node=last_parent)
+            last_parent = node
+
+
+class RawPlacementTests(GraphTestCase):
+    text = 'a|<question>b|c\n\n<reply>d\ne|f\n' + '\n'.join(f'l{i}|m{i}' for i in range(8))
+
+    def build_grid(self, project: Project) -> Node:
+        """Дерево с занятыми клетками под родителем и справа от него"""
+        self.project = project
+        parent = self.create_node('parent', 2, 1)
+        for y in range(2, 5):
+            for x in range(1, 8, 2):
+                self.create_node(f'existing {x} {y}', x, y, parent)
+        return parent
+
+    def positions(self, project: Project) -> dict:
+        return {content: (x, y, node_type) for content, x, y, node_type in
+                project.nodes.values_list('content', 'x', 'y', 'node_type__code')}
+
+    def test_matches_per_line_algorithm(self):
+        expected_project = Project.objects.create(name='expected', owner=self.user)
+        place_raw_nodes_per_line(expected_project, self.build_grid(expected_project), self.text.split('\n'))
+
+        project = Project.objects.create(name='actual', owner=self.user)
+        place_raw_nodes(project, self.build_grid(project), self.text.split('\n'))
+
+        self.assertEqual(self.positions(project), self.positions(expected_project))
+
+    def test_links_chain_to_parent(self):
+        parent = self.create_node('parent', 1, 1)
+        place_raw_nodes(self.project, parent, ['a|b'])
+
+        a, b = Node.objects.get(content='a'), Node.objects.get(content='b')
+        self.assertEqual(NodeRule.objects.get(node=a).connected_node, parent)
+        self.assertEqual(NodeRule.objects.get(node=b).connected_node, a)
+        self.assertEqual((b.x, b.y), (1, 3))
+
+
+class CloneTests(GraphTestCase):
+    def test_copies_nodes_and_rules(self):
+        root = self.create_node('root', 1, 1)
+        child = self.create_node('child', 1, 2, root)
+        self.create_node('grandchild', 1, 3, child)
+
+        clone = clone_project(self.project, self.user)
+
+        self.assertEqual(clone.name, 'project (copy)')
+        copied = {node.content: node for node in clone.nodes.all()}
+        self.assertEqual(set(copied), {'root', 'child', 'grandchild'})
+        self.assertEqual(NodeRule.objects.get(node=copied['grandchild']).connected_node, copied['child'])
+        self.assertEqual(NodeRule.objects.get(node=copied['child']).connected_node, copied['root'])
+        self.assertEqual(self.project.nodes.count(), 3)
+        clone.refresh_from_db()
+        self.assertEqual((clone.node_count, clone.rule_count), (3, 2))
+
+    def test_other_users_project_not_found(self):
+        self.create_node('root', 1, 1)
+        self.client.force_login(User.objects.create_user('other', password='password'))
+
+        response = self.client.post('/api/project/clone/', json.dumps({'project_id': self.project.id}),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Project.objects.count(), 1)
+
+
+class LayoutTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        self.child = self.create_node('child', 1, 2, self.root)
+        # Чужой для поддерева child узел на клетке, куда раскладка поставила бы его потомка
+        self.blocker = self.create_node('blocker', 1, 3, self.root)
+        self.grandchild = self.create_node('grandchild', 5, 5, self.child)
+
+    def post_layout(self, **data):
+        return self.client.post('/api/project/layout/', json.dumps({'project_id': self.project.id, **data}),
+                                content_type='application/json')
+
+    def cells(self) -> dict:
+        return {content: (x, y) for content, x, y in self.project.nodes.values_list('content', 'x', 'y')}
+
+    def test_subtree_avoids_cells_of_other_nodes(self):
+        response = self.post_layout(root=self.child.id)
+
+        self.assertEqual(response.status_code, 200)
+        cells = self.cells()
+        self.assertEqual((cells['root'], cells['child'], cells['blocker']), ((1, 1), (1, 2), (1, 3)))
+        self.assertEqual(cells['grandchild'][1], 3)
+        self.assertEqual(len(set(cells.values())), len(cells))
+
+    def test_other_users_project_not_found(self):
+        self.client.force_login(User.objects.create_user('other', password='password'))
+
+        response = self.post_layout()
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.cells()['grandchild'], (5, 5))
+
+
+class ImportJobTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.parent = self.create_node('parent', 1, 1)
+
+    def post_import(self):
+        return self.client.post('/api/project/add_raw_nodes/', json.dumps({
+            'project_id': self.project.id, 'active_node': self.parent.id, 'text': 'a|b\nc', 'async': True
+        }), content_type='application/json')
+
+    def test_job_result_matches_sync_import(self):
+        response = self.post_import()
+
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.content)['job_id']
+        # В TestCase on_commit не срабатывает, задание выполняется как командой run_import_jobs
+        self.assertTrue(run_job(job_id))
+        data = json.loads(self.client.get(f'/api/project/import_jobs/{job_id}/').content)
+        self.assertEqual((data['status'], data['processed'], data['total']), (ImportJob.DONE, 2, 2))
+        self.assertEqual({node['content'] for node in data['update']}, {'a', 'b', 'c'})
+
+    def test_other_users_project_not_found(self):
+        self.client.force_login(User.objects.create_user('other', password='password'))
+
+        response = self.post_import()
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_other_users_job_not_found(self):
+        job_id = json.loads(self.post_import().content)['job_id']
+        run_job(job_id)
+        self.client.force_login(User.objects.create_user('other', password='password'))
+
+        response = self.client.get(f'/api/project/import_jobs/{job_id}/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(API_COMPRESSION_MIN_SIZE=0)
+class CompressionTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_node('root', 1, 1)
+
+    def test_compresses_api_json(self):
+        for query in ('', '?stream=1'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/project/id/{self.project.id}/{query}', HTTP_ACCEPT_ENCODING='gzip')
+
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertEqual(json.loads(gzip.decompress(content))['project_id'], self.project.id)
+
+    def test_does_not_compress_html_pages(self):
+        self.client.logout()
+
+        response = self.client.get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class TypeRegistryTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        root = self.create_node('root', 1, 1)
+        types_registry.get()
+        # Тип, созданный другим процессом: сигналы этого процесса о нем не знают
+        late = NodeType.objects.bulk_create([NodeType(name='Поздний', code='late', color='#ff0000')])[0]
+        Node.objects.create(project=self.project, node_type=late, content='late', x=1, y=2)
+        self.create_node('child', 2, 2, root)
+
+    def test_reloads_unknown_type(self):
+        nodes = {node['content']: node for node in self.project.nodes_json_format}
+
+        self.assertEqual(nodes['late']['nodeType'], 'late')
+
+    async def test_async_load_reloads_types_before_serialization(self):
+        response = await aget_project(RequestFactory().get('/'), self.project)
+
+        nodes = {node['content']: node for node in json.loads(response.content)['nodes']}
+        self.assertEqual(nodes['late']['nodeType'], 'late')
+        self.assertEqual(nodes['child']['rules']['mustHave'], [nodes['root']['id']])
+
+    def test_merge_without_reload_raises(self):
+        node_rows, rule_rows = Node.js_format_rows(self.project.nodes.all())
+
+        with self.assertRaises(UnknownTypeError):
+            list(Node.merge_js_format(list(node_rows), list(rule_rows), types_registry.get()))
+
+
+class AsyncStreamTests(GraphTestCase):
+    async def test_streams_project_with_async_iterator(self):
+        root = await Node.objects.acreate(project=self.project, node_type=self.reply, content='root', x=1, y=1)
+        await NodeRule.objects.acreate(node=root, rule=self.must_have, connected_node=root)
+        request = RequestFactory().get('/', {'stream': '1'})
+
+        response = await aget_project(request, self.project)
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        expected = await sync_to_async(self.project.get_js_format)()
+        self.assertEqual(json.loads(body), json.loads(json_dumps(expected)))
+        self.assertEqual(response['ETag'], self.project.etag)
+
+
+class ProjectsPageTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('b', 'a', 'c', 'd', 'e'):
+            Project.objects.create(name=name, owner=self.user)
+        Project.objects.create(name='other', owner=User.objects.create_user('other', password='password'))
+
+    def get_page(self, **params):
+        return self.client.get('/api/projects/list/', params)
+
+    def test_cursor_walks_all_projects_in_order(self):
+        names, params = [], {'limit': 2}
+        while True:
+            data = json.loads(self.get_page(**params).content)
+            names += [project['name'] for project in data['projects']]
+            if not data['next']:
+                break
+            params['after'] = data['next']
+
+        self.assertEqual(names, ['a', 'b', 'c', 'd', 'e', 'project'])
+
+    def test_prefix(self):
+        data = json.loads(self.get_page(prefix='p').content)
+
+        self.assertEqual([project['name'] for project in data['projects']], ['project'])
+
+    def test_rejects_invalid_parameters(self):
+        for params in (
+            {'limit': 0},
+            {'limit': 'x'},
+            {'after': 'not base64!'},
+            {'after': encode_cursor({'name': 'a', 'id': 1})},
+            {'after': encode_cursor(['a'])},
+            {'after': encode_cursor(['a', 'x'])},
+            {'after': encode_cursor('a')},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.get_page(**params).status_code, 400)
+
+
+class ConditionalGetTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        self.url = f'/api/project/id/{self.project.id}/'
+
+    def test_not_modified_until_project_changes(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        nodes = self.project_nodes()
+        nodes[self.root.id]['content'] = 'changed'
+        save_nodes(self.project, list(nodes.values()))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['nodes'][0]['content'], 'changed')
+
+    def test_name_url_uses_same_etag(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(f'/api/project/name/{self.project.name}/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(API_PROJECT_SNAPSHOTS=True)
+class SnapshotTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        self.url = f'/api/project/id/{self.project.id}/'
+
+    def get_project(self) -> dict:
+        return json.loads(self.client.get(self.url).content)
+
+    def post(self, url: str, **data):
+        response = self.client.post(url, json.dumps({'project_id': self.project.id, **data}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_matches_assembled_response(self):
+        self.get_project()
+        self.assertTrue(ProjectSnapshot.objects.filter(project=self.project).exists())
+
+        with self.settings(API_PROJECT_SNAPSHOTS=False):
+            expected = self.get_project()
+        self.assertEqual(self.get_project(), expected)
+
+    def test_rebuilt_after_each_write(self):
+        self.get_project()
+
+        self.post('/api/project/save_operations/',
+                  operations=[{'type': 'editContent', 'id': self.root.id, 'content': 'edited'}])
+        self.assertEqual(self.get_project()['nodes'][0]['content'], 'edited')
+
+        self.post('/api/project/add_raw_nodes/', active_node=self.root.id, text='child')
+        self.assertEqual({node['content'] for node in self.get_project()['nodes']}, {'edited', 'child'})
+
+        nodes = self.get_project()['nodes']
+        nodes[0]['content'] = 'saved'
+        self.post('/api/project/save/', nodes=nodes)
+        self.assertIn('saved', {node['content'] for node in self.get_project()['nodes']})
+
+    def test_rebuilt_after_type_change_in_admin(self):
+        self.get_project()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/admin/API/nodetype/{self.reply.id}/change/', {
+                'name': self.reply.name, 'code': self.reply.code, 'color': '#123456',
+            })
+
+        self.assertEqual(response.status_code, 302)
+        node_types = {node_type['code']: node_type for node_type in self.get_project()['nodeTypes']}
+        self.assertEqual(node_types['reply']['color'], '#123456')
+
+    def test_rebuilt_when_types_change_after_revision(self):
+        # Чтение между коммитом изменения типов и сбросом реестра: ревизия уже новая, типы еще старые
+        types_registry.get()
+        Project.bump_revisions(Project.objects.all())
+        NodeType.objects.filter(id=self.reply.id).update(color='#123456')
+        self.project.refresh_from_db()
+        self.get_project()
+
+        types_registry.invalidate()
+
+        node_types = {node_type['code']: node_type for node_type in self.get_project()['nodeTypes']}
+        self.assertEqual(node_types['reply']['color'], '#123456')
+
+
+class TokenCacheTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+        token_cache.clear()
+        application = Application.objects.create(
+            name='app', user=self.user, client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_PASSWORD,
+        )
+        self.access_token = AccessToken.objects.create(
+            user=self.user, application=application, token='secret-token', scope='read write',
+            expires=timezone.now() + timedelta(hours=1),
+        )
+
+    def get_projects(self):
+        return self.client.get('/api/projects/', HTTP_AUTHORIZATION='Bearer secret-token')
+
+    def test_cached_token_skips_token_lookup(self):
+        self.assertEqual(self.get_projects().status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_projects().status_code, 200)
+        self.assertFalse(any('oauth2_provider_accesstoken' in query['sql'] for query in queries.captured_queries))
+
+    def test_revoked_token_is_rejected_at_once(self):
+        self.assertEqual(self.get_projects().status_code, 200)
+
+        self.access_token.revoke()
+
+        self.assertEqual(self.get_projects().status_code, 302)
+
+    def test_entry_does_not_outlive_token(self):
+        self.access_token.expires = timezone.now() + timedelta(seconds=5)
+        self.access_token.save()
+
+        owner = token_cache.set('secret-token', self.access_token)
+
+        self.assertLessEqual(owner.deadline, self.access_token.expires.timestamp())
+
+
+class MetricsTests(GraphTestCase):
+    def test_only_staff_and_allowed_ips_read_metrics(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        with self.settings(API_METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    def test_records_api_requests(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(f'/api/project/id/{self.project.id}/')
+
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('view="get_full_project_by_id"', self.client.get('/api/metrics/').content.decode())
+        self.assertFalse(self.client.get('/admin/').has_header('Server-Timing'))
+
+
+class ViewportTests(GraphTestCase):
+    def test_returns_nodes_inside_and_crossing_edges(self):
+        root = self.create_node('root', 1, 1)
+        child = self.create_node('child', 1, 2, root)
+        far = self.create_node('far', 5, 5, child)
+
+        response = self.client.get(f'/api/project/id/{self.project.id}/viewport/',
+                                   {'x1': 2, 'y1': 2, 'x2': 1, 'y2': 1})
+
+        data = json.loads(response.content)
+        self.assertEqual({node['content'] for node in data['nodes']}, {'root', 'child'})
+        self.assertEqual(data['edges'], [{'node': far.id, 'rule': 'mustHave', 'connectedNode': child.id}])
+
+    def test_rejects_non_integer_bounds(self):
+        response = self.client.get(f'/api/project/id/{self.project.id}/viewport/', {'x1': 1, 'y1': 1, 'x2': 'a'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class SubgraphTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        self.child = self.create_node('child', 1, 2, self.root)
+        self.grandchild = self.create_node('grandchild', 1, 3, self.child)
+        # Цикл: обход должен завершиться
+        NodeRule.objects.create(node=self.root, rule=self.never, connected_node=self.grandchild)
+
+    def subgraph(self, node: Node, **params) -> set:
+        response = self.client.get(f'/api/project/id/{self.project.id}/subgraph/{node.id}/', params)
+        self.assertEqual(response.status_code, 200)
+        return {node['content'] for node in json.loads(response.content)['nodes']}
+
+    def test_directions_and_depth(self):
+        self.assertEqual(self.subgraph(self.child), {'root', 'child', 'grandchild'})
+        self.assertEqual(self.subgraph(self.child, depth=1), {'child', 'grandchild'})
+        self.assertEqual(self.subgraph(self.child, direction='ancestors', depth=1), {'child', 'root'})
+
+    def test_rule_filter(self):
+        self.assertEqual(self.subgraph(self.child, rules='mustHave'), {'child', 'grandchild'})
+        self.assertEqual(self.subgraph(self.grandchild, rules='never'), {'grandchild', 'root'})
+
+    def test_rejects_invalid_parameters(self):
+        for params in ({'direction': 'up'}, {'depth': -1}, {'rules': 'unknown'}):
+            with self.subTest(params=params):
+                response = self.client.get(
+                    f'/api/project/id/{self.project.id}/subgraph/{self.root.id}/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class TransferTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other', password='password')
+        root = self.create_node('root', 1, 1)
+        child = self.create_node('child', 1, 2, root)
+        self.create_node('grandchild', 2, 3, child)
+        self.create_node('second child', 2, 2, root)
+
+    def graph(self, project: Project) -> set:
+        contents = dict(project.nodes.values_list('id', 'content'))
+        return {
+            (contents[node_id], code, contents[connected_node_id])
+            for node_id, code, connected_node_id in NodeRule.objects.filter(node__project=project).values_list(
+                'node_id', 'rule__code', 'connected_node_id')
+        } | set(project.nodes.values_list('content', 'x', 'y', 'node_type__code'))
+
+    def test_round_trip_in_small_chunks(self):
+        lines = list(iter_project_lines(self.project, chunk_size=2))
+
+        [imported] = import_projects(lines, owner=self.other, chunk_size=2)
+
+        self.assertEqual((imported.name, imported.owner), ('project', self.other))
+        self.assertEqual(self.graph(imported), self.graph(self.project))
+        imported.refresh_from_db()
+        self.assertEqual((imported.node_count, imported.rule_count), (4, 3))
+
+    def test_invalid_project_is_rolled_back(self):
+        lines = list(iter_project_lines(self.project))
+        broken = lines[:-1] + [json.dumps({'type': 'rule', 'node': 10 ** 9, 'rule': 'mustHave', 'connectedNode': 1})]
+
+        for records in (broken, [lines[0], lines[2], lines[1]]):
+            with self.subTest(records=records), self.assertRaises(TransferError):
+                list(import_projects(records, owner=self.other))
+        self.assertFalse(self.other.projects.exists())
+
+
+class SearchTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.greeting = self.create_node('Привет, <b>мир</b>', 1, 1)
+        self.create_node('Как дела?', 1, 2)
+        other_project = Project.objects.create(name='other', owner=User.objects.create_user('other'))
+        Node.objects.create(project=other_project, node_type=self.reply, content='привет чужой', x=1, y=1)
+
+    def search(self, query: str, **params) -> list:
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['results']
+
+    def test_finds_own_nodes_by_word_prefix(self):
+        [result] = self.search('ПРИВ')
+
+        self.assertEqual(result['node_id'], self.greeting.id)
+        self.assertEqual(result['snippet'], '<mark>Привет</mark>, &lt;b&gt;мир&lt;/b&gt;')
+
+    def test_index_follows_updates_and_deletes(self):
+        Node.objects.filter(id=self.greeting.id).update(content='До свидания')
+        self.assertEqual(self.search('привет'), [])
+        self.assertEqual(len(self.search('свидания')), 1)
+
+        self.greeting.delete()
+        self.assertEqual(self.search('свидания'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('привет OR дела'), [])
+        self.assertEqual(self.search('"'), [])
+        self.assertEqual(len(self.search('дела', project_id=self.project.id)), 1)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('API.db.get_replicas', return_value=['replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+
+    def call(self, view, request=None) -> HttpResponse:
+        return ReplicaMiddleware(view)(request or RequestFactory().get('/'))
+
+    def read_view(self, request):
+        return HttpResponse(f'{self.router.db_for_read(Node)} {self.router.db_for_read(User)}')
+
+    def test_reads_from_replica_only_in_marked_views(self):
+        self.assertIsNone(self.router.db_for_read(Node))
+        self.assertEqual(self.call(self.read_view).content, b'default None')
+        self.assertEqual(self.call(replica_reads(self.read_view)).content, b'replica None')
+
+    def test_reads_from_default_after_write(self):
+        def write_view(request):
+            self.router.db_for_write(Node)
+            return self.read_view(request)
+
+        response = self.call(replica_reads(write_view))
+
+        self.assertEqual(response.content, b'default None')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.assertEqual(self.call(replica_reads(self.read_view), request).content, b'default None')
+
+
+class ChangeFeedTests(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.create_node('root', 1, 1)
+        patcher = mock.patch.object(change_broker, 'has_subscribers', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(change_broker._history.pop, self.project.id, None)
+
+    def edit_root(self, content: str):
+        operation = {'type': 'editContent', 'id': self.root.id, 'content': content}
+        return self.client.post('/api/project/save_operations/', json.dumps({
+            'project_id': self.project.id, 'operations': [operation]
+        }), content_type='application/json')
+
+    def test_publishes_event_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.edit_root('edited')
+            self.assertNotIn(self.project.id, change_broker._history)
+
+        self.project.refresh_from_db()
+        [event] = change_broker._history[self.project.id]
+        self.assertEqual(event.revision, self.project.revision)
+        data = json.loads(event.text.split('data: ', 1)[1])
+        self.assertEqual([node['content'] for node in data['nodes']], ['edited'])
+        self.assertEqual(change_broker.missed_events(self.project, self.project.revision - 1), [event])
+        self.assertIsNone(change_broker.missed_events(self.project, self.project.revision - 2))
+
+    def test_failed_delivery_does_not_fail_save(self):
+        with mock.patch.object(LocalBackend, 'publish', side_effect=ConnectionError), \
+                self.assertLogs('django.test', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.edit_root('edited')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Node.objects.get(id=self.root.id).content, 'edited')
+
+
+class ProjectLoaderTests(GraphTestCase):
+    def test_query_count_does_not_depend_on_size(self):
+        url = f'/api/project/id/{self.project.id}/'
+        # Первый запрос еще загружает реестр типов
+        self.client.get(url)
+        counts = []
+        for size in (1, 50):
+            parent = None
+            for i in range(size):
+                parent = self.create_node(f'node {size} {i}', i + 1, size, parent)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'stream': 0})
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(json.loads(response.content)['nodes']), 51)
@@ -0,0 +1,168 @@
+"""
+Построчный формат переноса проектов (manage.py export_projects / import_projects).
+
+Каждая строка - JSON-объект с полем "type":
+    {"type": "project", "name": ..., "owner": <username>}
+    {"type": "node", "id": ..., "nodeType": <code>, "content": ..., "x": ..., "y": ...}
+    {"type": "rule", "node": <id>, "rule": <code>, "connectedNode": <id>}
+Строки проекта идут подряд: заголовок, узлы по возрастанию id, затем правила. Типы узлов и правил
+передаются кодами, id узлов - исходные, при импорте они заменяются новыми.
+Ни экспорт, ни импорт не держат проект в памяти целиком: строки читаются и пишутся курсором и пачками.
+"""
+import bisect
+import gzip
+import json
+import sys
+import typing
+from array import array
+
+from django.db import transaction, IntegrityError
+
+from API.models import Project, Node, NodeRule
+from API.registry import types_registry
+from users.models import User
+
+# Сколько строк читать курсором и создавать одним bulk_create
+TRANSFER_CHUNK_SIZE = 2000
+
+
+class TransferError(Exception):
+    """Ошибка в данных импорта: неизвестный тип, узел, владелец или нарушен порядок строк"""
+
+
+def open_stream(path: str, mode: str) -> typing.TextIO:
+    """Файл для чтения ('r') или записи ('w'); '-' - стандартный поток, *.gz - со сжатием gzip"""
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def dump_line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_project_lines(project: Project, chunk_size: int = TRANSFER_CHUNK_SIZE) -> typing.Iterator[str]:
+    types = types_registry.get()
+    node_type_codes = {node_type.id: node_type.code for node_type in types.node_types}
+    rule_codes = {rule_type.id: rule_type.code for rule_type in types.rule_types}
+
+    yield dump_line({'type': 'project', 'name': project.name, 'owner': project.owner.username})
+    for node_id, node_type_id, content, x, y in project.nodes.order_by('id').values_list(
+            'id', 'node_type_id', 'content', 'x', 'y').iterator(chunk_size=chunk_size):
+        yield dump_line({
+            'type': 'node', 'id': node_id, 'nodeType': node_type_codes[node_type_id], 'content': content, 'x': x, 'y': y
+        })
+    for node_id, rule_id, connected_node_id in NodeRule.objects.filter(node__project=project).order_by(
+            'node_id', 'id').values_list('node_id', 'rule_id', 'connected_node_id').iterator(chunk_size=chunk_size):
+        yield dump_line({'type': 'rule', 'node': node_id, 'rule': rule_codes[rule_id], 'connectedNode': connected_node_id})
+
+
+def export_projects(projects: typing.Iterable[Project], path: str) -> int:
+    """Пишет проекты в файл path друг за другом. Возвращает число проектов"""
+    count = 0
+    stream = open_stream(path, 'w')
+    try:
+        for project in projects:
+            stream.writelines(iter_project_lines(project))
+            count += 1
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return count
+
+
+def import_projects(lines: typing.Iterable[str], owner: typing.Optional[User] = None,
+                    chunk_size: int = TRANSFER_CHUNK_SIZE) -> typing.Iterator[Project]:
+    """
+    Создает проекты из строк формата экспорта, каждый в своей транзакции, и отдает их по мере создания.
+    owner заменяет владельца из файла. Ошибка в данных проекта откатывает только его и выбрасывает TransferError.
+    """
+    records = (json.loads(line) for line in lines if line.strip())
+    header = next(records, None)
+    while header is not None:
+        if header.get('type') != 'project':
+            raise TransferError(f'Expected a project record, got {header.get("type")!r}')
+        project_owner = owner or User.objects.filter(username=header.get('owner')).first()
+        if project_owner is None:
+            raise TransferError(f'User {header.get("owner")!r} not found')
+        with transaction.atomic():
+            project, header = _import_project(header, records, project_owner, chunk_size)
+        yield project
+
+
+def _import_project(header: dict, records: typing.Iterator[dict], owner: User,
+                    chunk_size: int) -> typing.Tuple[Project, typing.Optional[dict]]:
+    """Создает проект из заголовка и следующих за ним записей. Возвращает проект и заголовок следующего проекта"""
+    # Транзакция начинается с записи: в SQLite чтение перед записью не дождалось бы блокировки параллельного импорта
+    try:
+        with transaction.atomic():
+            project = Project.objects.create(name=header['name'], owner=owner)
+    except IntegrityError:
+        raise TransferError(f'Project {header["name"]!r} of {owner.username} already exists')
+
+    types = types_registry.get()
+    node_types = {node_type.code: node_type.id for node_type in types.node_types}
+    rule_types = {rule_type.code: rule_type.id for rule_type in types.rule_types}
+
+    # Соответствие исходных id новым: узлы идут по возрастанию id, поэтому хватает двух массивов и двоичного поиска
+    old_ids, new_ids = array('q'), array('q')
+
+    def new_id(old_id) -> int:
+        i = bisect.bisect_left(old_ids, old_id)
+        if i == len(old_ids) or old_ids[i] != old_id:
+            raise TransferError(f'Node {old_id} not found in project {project.name!r}')
+        return new_ids[i]
+
+    def code_id(codes: typing.Dict[str, int], code: str) -> int:
+        if code not in codes:
+            raise TransferError(f'Unknown type {code!r}')
+        return codes[code]
+
+    nodes, node_old_ids, rules = [], [], []
+    rules_started = False
+
+    def flush_nodes():
+        Node.objects.bulk_create(nodes)
+        old_ids.extend(node_old_ids)
+        new_ids.extend(node.id for node in nodes)
+        nodes.clear()
+        node_old_ids.clear()
+
+    def flush_rules():
+        NodeRule.objects.bulk_create(rules)
+        rules.clear()
+
+    for record in records:
+        record_type = record.get('type')
+        if record_type == 'project':
+            break
+        if record_type == 'node':
+            last_id = node_old_ids[-1] if node_old_ids else old_ids[-1] if old_ids else None
+            if rules_started or last_id is not None and last_id >= record['id']:
+                raise TransferError('Nodes must go before rules, ordered by id')
+            nodes.append(Node(project=project, node_type_id=code_id(node_types, record['nodeType']),
+                              content=record['content'], x=record['x'], y=record['y']))
+            node_old_ids.append(record['id'])
+            if len(nodes) >= chunk_size:
+                flush_nodes()
+        elif record_type == 'rule':
+            if nodes:
+                flush_nodes()
+            rules_started = True
+            rules.append(NodeRule(node_id=new_id(record['node']), rule_id=code_id(rule_types, record['rule']),
+                                  connected_node_id=new_id(record['connectedNode'])))
+            if len(rules) >= chunk_size:
+                flush_rules()
+        else:
+            raise TransferError(f'Unknown record type {record_type!r}')
+    else:
+        record = None
+
+    if nodes:
+        flush_nodes()
+    if rules:
+        flush_rules()
+    Project.update_counters(Project.objects.filter(id=project.id))
+    return project, record
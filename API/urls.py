@@ -1,13 +1,28 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, async_views
+
+# Читающие представления: асинхронные версии для запуска через asgi.py
+read_views = async_views if getattr(settings, 'API_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('projects/', views.projects, name='projects'),
+    path('projects/', read_views.projects, name='projects'),
+    path('projects/list/', views.projects_page, name='projects_page'),
     path('create_project/<str:project_name>/', views.create_project, name='create_project'),
     path('create_project/', views.create_project, name='create_project_with_param'),
-    path('project/id/<int:project_id>/', views.get_full_project_by_id, name='get_full_project_by_id'),
-    path('project/name/<str:project_name>/', views.get_full_project_by_name, name='get_full_project_by_name'),
+    path('project/clone/', views.clone_project_view, name='clone_project'),
+    path('project/id/<int:project_id>/', read_views.get_full_project_by_id, name='get_full_project_by_id'),
+    path('project/id/<int:project_id>/viewport/', views.get_project_viewport, name='get_project_viewport'),
+    path('project/id/<int:project_id>/subgraph/<int:node_id>/', views.get_project_subgraph,
+         name='get_project_subgraph'),
+    path('project/id/<int:project_id>/changes/', async_views.project_changes, name='project_changes'),
+    path('project/name/<str:project_name>/', read_views.get_full_project_by_name, name='get_full_project_by_name'),
     path('project/save/', views.save_project, name='save_project'),
+    path('project/save_operations/', views.save_project_operations, name='save_project_operations'),
     path('project/add_raw_nodes/', views.add_raw_nodes, name='add_raw_nodes'),
+    path('project/import_jobs/<int:job_id>/', views.import_job, name='import_job'),
+    path('project/layout/', views.layout_project, name='layout_project'),
+    path('search/', views.search, name='search'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -1,41 +1,59 @@
+import base64
+import binascii
 import json
-import re
 import typing
 from urllib.parse import urlencode
 
 from django.conf import settings
-from django.db.models import QuerySet
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
-from oauth2_provider.decorators import protected_resource
 
-from API.models import Project, Node, NodeRule
-from users.models import User
+from API.graph import save_nodes, apply_operations, OperationError, place_raw_nodes, \
+    nodes_js_format, viewport_js_format, reachable_nodes, SUBGRAPH_DIRECTIONS, layout_nodes, clone_project, CloneError
+from API.db import replica_reads
+from API.http import JsonResponse, json_dumps
+from API.jobs import enqueue_import
+from API.metrics import metrics_registry
+from API.models import Project, Node, ProjectSnapshot, ImportJob
+from API.oauth import get_token_owner
+from API.search import search_nodes, SEARCH_LIMIT
 
 
-@protected_resource()
-def get_resource_owner(request):
-    return request.resource_owner
+def get_request_user(request):
+    # Пользователь с сессией уже аутентифицирован, OAuth-токен можно не проверять
+    if request.user.is_authenticated:
+        return request.user
+    token_owner = get_token_owner(request)
+    if token_owner:
+        request.scopes = token_owner.scopes
+        return token_owner.user
+    return request.user
+
+
+def redirect_to_login(request):
+    query_string = urlencode({'next': request.path})
+    url = '{}?{}'.format(settings.LOGIN_URL, query_string)
+    return redirect(url)
 
 
 def either_login_required(func):
     def wrapper(request, *args, **kwargs):
-        oauth2_client = get_resource_owner(request)
-        if isinstance(oauth2_client, User):
-            request.user = oauth2_client
+        request.user = get_request_user(request)
         if request.user.is_authenticated:
             return func(request, *args, **kwargs)
         else:
-            query_string = urlencode({'next': request.path})
-            url = '{}?{}'.format(settings.LOGIN_URL, query_string)
-            return redirect(url)
+            return redirect_to_login(request)
 
     return wrapper
 
 
 @csrf_exempt
 @either_login_required
+@replica_reads
 def projects(request):
     # Здесь вы можете обработать данные POST
     user = request.user
@@ -43,6 +61,63 @@ def projects(request):
     return JsonResponse(data)
 
 
+PROJECTS_PAGE_SIZE = 50
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+
+@csrf_exempt
+@either_login_required
+@replica_reads
+def projects_page(request):
+    """
+    Проекты пользователя по имени, страницами по limit: курсор "next" из ответа передается в ?after=.
+    Счетчики узлов и правил хранятся в проекте, поэтому страница читается одним запросом по индексу.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', PROJECTS_PAGE_SIZE)), PROJECTS_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(limit)
+        after = decode_cursor(request.GET['after']) if request.GET.get('after') else None
+        if after is not None:
+            if not isinstance(after, list) or len(after) != 2:
+                raise ValueError(after)
+            after_name, after_id = str(after[0]), int(after[1])
+    except (ValueError, TypeError, binascii.Error):
+        return JsonResponse({'error': 'Invalid "limit" or "after"'}, status=400)
+
+    projects = request.user.projects.order_by('name', 'id')
+    if request.GET.get('prefix'):
+        projects = projects.filter(name__startswith=request.GET['prefix'])
+    if after is not None:
+        projects = projects.filter(Q(name__gt=after_name) | Q(name=after_name, id__gt=after_id))
+
+    page = list(projects.values('id', 'name', 'node_count', 'rule_count', 'revision', 'last_modified')[:limit + 1])
+    next_cursor = encode_cursor([page[limit - 1]['name'], page[limit - 1]['id']]) if len(page) > limit else None
+
+    return JsonResponse({
+        'error': 0,
+        'projects': [
+            {
+                'id': project['id'],
+                'name': project['name'],
+                'nodes': project['node_count'],
+                'rules': project['rule_count'],
+                'revision': project['revision'],
+                'last_modified': project['last_modified'],
+            }
+            for project in page[:limit]
+        ],
+        'next': next_cursor,
+    })
+
+
 @csrf_exempt
 @either_login_required
 def create_project(request, project_name=None):
@@ -69,6 +144,25 @@ def create_project(request, project_name=None):
 
 @csrf_exempt
 @either_login_required
+def clone_project_view(request):
+    data: typing.Dict = get_json_from_request(request)
+    if isinstance(data, JsonResponse):
+        return data
+    project: typing.Union[Project, JsonResponse] = get_project_from_request(data, request.user)
+    if isinstance(project, JsonResponse):
+        return project
+
+    try:
+        clone = clone_project(project, request.user, data.get('new_name') or None)
+    except CloneError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    return JsonResponse({'error': 0, 'project_name': clone.name, 'project_id': clone.id})
+
+
+@csrf_exempt
+@either_login_required
+@replica_reads
 def get_full_project_by_name(request, project_name):
     project = Project.objects.filter(name=project_name, owner=request.user).first()
     if project:
@@ -78,6 +172,7 @@ def get_full_project_by_name(request, project_name):
 
 @csrf_exempt
 @either_login_required
+@replica_reads
 def get_full_project_by_id(request, project_id):
     project = Project.objects.filter(id=project_id, owner=request.user).first()
     if project:
@@ -85,29 +180,157 @@ def get_full_project_by_id(request, project_id):
     return JsonResponse({'error': "No project found"})
 
 
-def get_project(request, project: Project):
+@csrf_exempt
+@either_login_required
+def get_project_viewport(request, project_id):
+    project = Project.objects.filter(id=project_id, owner=request.user).first()
+    if not project:
+        return JsonResponse({'error': "No project found"})
+
+    try:
+        x1, y1, x2, y2 = (int(request.GET[key]) for key in ('x1', 'y1', 'x2', 'y2'))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parameters "x1", "y1", "x2", "y2" must be integers'}, status=400)
+
+    return JsonResponse({
+        'error': 0,
+        'project_id': project.id,
+        **viewport_js_format(project, min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+    })
+
+
+@csrf_exempt
+@either_login_required
+def get_project_subgraph(request, project_id, node_id):
+    project = Project.objects.filter(id=project_id, owner=request.user).first()
+    if not project:
+        return JsonResponse({'error': "No project found"})
+    if not project.nodes.filter(id=node_id).exists():
+        return JsonResponse({'error': "No node found"}, status=404)
+
+    direction = request.GET.get('direction', 'descendants')
+    if direction not in SUBGRAPH_DIRECTIONS:
+        return JsonResponse({'error': 'Parameter "direction" must be "ancestors" or "descendants"'}, status=400)
+
+    try:
+        depth = int(request.GET['depth']) if request.GET.get('depth') else None
+        if depth is not None and depth < 0:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'Parameter "depth" must be a non-negative integer'}, status=400)
+
+    rule_ids = None
+    if request.GET.get('rules'):
+        rule_types = {i.code: i.id for i in project.get_avalaible_rule_types()}
+        codes = request.GET['rules'].split(',')
+        if any(code not in rule_types for code in codes):
+            return JsonResponse({'error': 'Unknown rule type'}, status=400)
+        rule_ids = [rule_types[code] for code in codes]
+
     return JsonResponse({
         'error': 0,
-        'project_name': project.name,
         'project_id': project.id,
-        'nodes': project.nodes_json_format,
+        'node_id': node_id,
+        'direction': direction,
+        'nodes': Node.bulk_js_format(reachable_nodes(project, node_id, direction, depth, rule_ids)),
+    })
+
+
+@csrf_exempt
+@either_login_required
+def search(request):
+    query = request.GET.get('q', '')
+    try:
+        project_id = int(request.GET['project_id']) if request.GET.get('project_id') else None
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), SEARCH_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'Parameters "project_id" and "limit" must be integers'}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': 'Parameter "limit" must be positive'}, status=400)
+
+    return JsonResponse({'error': 0, 'results': search_nodes(request.user, query, project_id, limit)})
+
+
+def get_project(request, project: Project):
+    not_modified = get_conditional_response(
+        request, etag=project.etag, last_modified=int(project.last_modified.timestamp()))
+    if not_modified:
+        return not_modified
+
+    stream = is_stream_requested(request)
+    if stream is None:
+        threshold = getattr(settings, 'API_PROJECT_STREAM_THRESHOLD', None)
+        stream = threshold is not None and project.nodes.count() > threshold
+    return get_project_response(project, stream)
+
+
+def get_project_response(project: Project, stream: bool):
+    if stream:
+        response = StreamingHttpResponse(stream_project(project), content_type='application/json')
+    elif getattr(settings, 'API_PROJECT_SNAPSHOTS', False):
+        response = HttpResponse(ProjectSnapshot.get_data(project), content_type='application/json')
+    else:
+        response = JsonResponse(project.get_js_format())
+    return set_project_headers(response, project)
+
+
+def set_project_headers(response, project: Project):
+    response.headers['ETag'] = project.etag
+    response.headers['Last-Modified'] = http_date(int(project.last_modified.timestamp()))
+    return response
+
+
+def metrics(request):
+    allowed_ips = getattr(settings, 'API_METRICS_ALLOWED_IPS', ())
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def is_stream_requested(request) -> typing.Optional[bool]:
+    """Явный выбор потоковой отдачи параметром ?stream=; None, если параметра нет"""
+    stream = request.GET.get('stream')
+    if stream is None:
+        return None
+    return stream not in ('0', 'false')
+
+
+def stream_project(project: Project, nodes_per_chunk: int = 500) -> typing.Iterator[bytes]:
+    """
+    Тот же JSON, что отдает get_project, но по частям: узлы читаются курсором и кодируются пачками,
+    поэтому память на запрос не зависит от размера проекта.
+    """
+    head = json_dumps({'error': 0, 'project_name': project.name, 'project_id': project.id})
+    yield head[:-1] + b',"nodes":['
+
+    chunk, separator = [], b''
+    for node in Node.iter_js_format(project.nodes.all()):
+        chunk.append(json_dumps(node))
+        if len(chunk) == nodes_per_chunk:
+            yield separator + b','.join(chunk)
+            chunk, separator = [], b','
+    if chunk:
+        yield separator + b','.join(chunk)
+
+    tail = json_dumps({
         'nodeTypes': project.node_types_json_format,
         'ruleTypes': project.rule_types_json_format,
         'defaultRuleType': project.default_rule_type.code
-
     })
+    yield b'],' + tail[1:]
 
 
-def get_project_from_request(data):
+def get_project_from_request(data, owner):
+    """Проект owner по project_name или project_id; чужой проект не найдется, как и несуществующий"""
     project: typing.Union[Project, None] = None
 
     try:
         if data.get('project_name'):
-            project = Project.objects.filter(name=data['project_name']).first()
+            project = Project.objects.filter(name=data['project_name'], owner=owner).first()
             if not project:
                 return JsonResponse({'error': 'Project not found'}, status=404)
         elif data.get('project_id'):
-            project = Project.objects.filter(id=int(data['project_id'])).first()
+            project = Project.objects.filter(id=int(data['project_id']), owner=owner).first()
             if not project:
                 return JsonResponse({'error': 'Project not found'}, status=404)
     except Exception as e:
@@ -140,150 +363,52 @@ def save_project(request):
     data: typing.Dict = get_json_from_request(request)
     if isinstance(data, JsonResponse):
         return data
-    project: typing.Union[Project, JsonResponse] = get_project_from_request(data)
+    project: typing.Union[Project, JsonResponse] = get_project_from_request(data, request.user)
     if isinstance(project, JsonResponse):
         return project
 
     saving_nodes = data.get('nodes')
-    new_nodes = {}
     if saving_nodes == None:
         return JsonResponse({'error': 'Missing parameter "nodes"'}, status=400)
 
-    nodes = project.nodes.all()
-    nodes_for_delete = list(map(lambda x: x.id, nodes))
-
-    node_types = {i.code: i.id for i in project.get_avalaible_node_types()}
-    rule_types = {i.code: i.id for i in project.get_avalaible_rule_types()}
-
-    modified = 0
-
     try:
-
-        rules_after_created = {}
-
-        for node in saving_nodes:
-            node_entity: Node = nodes.filter(id=int(node["id"])).first()
-            if node_entity:
-                try:
-                    if node_entity.x == 0 or node_entity.y == 0:
-                        continue
-                    nodes_for_delete.remove(node["id"])
-                except ValueError:
-                    pass
-
-                if node_entity.get_js_format() != node:
-                    modified += 1
-                    node_entity.node_type_id = node_types[node["nodeType"]]
-                    node_entity.content = node["content"]
-                    node_entity.x, node_entity.y = node["location"]["x"], node["location"]["y"]
-
-                    node_rules: QuerySet = node_entity.node_rules.filter(node=node_entity)
-                    rules_for_delete: typing.List[int] = list(map(lambda x: x.id, node_rules))
-                    for rule, nodes_links in node['rules'].items():
-
-                        if rule in rule_types.keys():
-                            rule_id = rule_types[rule]
-                        else:
-                            raise Exception('Unknown rule type')
-
-                        for node_link in nodes_links:
-                            rule_entity: NodeRule = node_rules.filter(
-                                connected_node_id=node_link).first()
-                            if rule_entity:
-                                try:
-                                    rules_for_delete.remove(rule_entity.id)
-                                except ValueError:
-                                    pass
-                                rule_entity.rule_id = rule_id  # Обновление правила если между двумя узлами оно уже есть
-                                rule_entity.save()
-                            else:
-                                connected_node: Node = nodes.filter(id=int(node_link)).first()
-                                if connected_node:
-                                    NodeRule.objects.create(
-                                        node=node_entity,
-                                        rule_id=rule_id,
-                                        connected_node=connected_node
-                                    )
-                                else:
-                                    if not int(node_link) in rules_after_created:
-                                        rules_after_created[int(node_link)] = []
-                                    rules_after_created[int(node_link)].append((node_entity.id, rule_id))
-
-                    else:
-                        for rule_d in rules_for_delete:
-                            node_rule: NodeRule = node_rules.filter(id=rule_d).first()
-                            if node_rule:
-                                node_rule.delete()
-
-                node_entity.save()
-            else:
-                node_entity = Node(
-                    node_type_id=node_types[node["nodeType"]],
-                    content=node["content"],
-                    x=node["location"]["x"],
-                    y=node["location"]["y"],
-                    project=project
-                )
-                node_entity.save()
-                new_nodes[int(node["id"])] = node_entity.id
-
-                for rule, nodes_links in node['rules'].items():
-
-                    if rule in rule_types.keys():
-                        rule_id = rule_types[rule]
-                    else:
-                        raise Exception('Unknown rule type')
-                    for node_link in nodes_links:
-                        # NodeRule.objects.create(node=node_entity, rule_id=rule_id, connected_node_id=node_link)
-                        # connected_id = new_nodes[int(node_link)] if int(node_link) in new_nodes else
-                        connected_node: Node = nodes.filter(id=int(node_link)).first()
-                        if connected_node:
-                            NodeRule.objects.create(
-                                node=node_entity,
-                                rule_id=rule_id,
-                                connected_node=connected_node
-                            )
-                        else:
-                            if not int(node_link) in rules_after_created:
-                                rules_after_created[int(node_link)] = []
-                            rules_after_created[int(node_link)].append((node_entity.id, rule_id))
-                if node["id"] in rules_after_created.keys():
-                    for node_id, rule_id in rules_after_created[node_entity.id]:
-                        NodeRule.objects.create(connected_node=node_entity, rule_id=rule_id, node_id=node_id)
-        for node in nodes_for_delete:
-            node_entity: Node = Node.objects.filter(id=int(node)).first()
-            if node_entity:
-                node_entity.delete()
-
-
+        summary = save_nodes(project, saving_nodes)
     except Exception as e:
         return JsonResponse({'error': 'Something went wrong'}, status=500)
 
-    project.save()
-
     return JsonResponse({
         'error': 0,
         "project_name": project.name,
-        "deleted": len(nodes_for_delete),
-        "modified": modified,
-        "added": len(new_nodes),
-        "new_nodes_ids": new_nodes
+        **summary
     }, status=200)
 
 
-node_string_re = re.compile(r'(?:<([^>]+)>)?(.+)')
+@csrf_exempt
+@either_login_required
+def save_project_operations(request):
+    data: typing.Dict = get_json_from_request(request)
+    if isinstance(data, JsonResponse):
+        return data
+    project: typing.Union[Project, JsonResponse] = get_project_from_request(data, request.user)
+    if isinstance(project, JsonResponse):
+        return project
 
+    operations = data.get('operations')
+    if not isinstance(operations, list):
+        return JsonResponse({'error': 'Missing parameter "operations"'}, status=400)
 
-def place_and_move_other_nodes(node, nodes):
-    conflict_node = nodes.filter(x=node.x).exclude(id=node.id).first()
-    if conflict_node:
-        conflict_node.x += 1
-        conflict_node.save()
-        nodes_mod = {conflict_node}
-        nodes: typing.Set[Node] = place_and_move_other_nodes(conflict_node, nodes)
-        nodes_mod.update(nodes)
-        return nodes_mod
-    return set()
+    try:
+        summary = apply_operations(project, operations)
+    except OperationError as e:
+        return JsonResponse({'error': str(e), 'operation': e.index}, status=400)
+    except Exception:
+        return JsonResponse({'error': 'Something went wrong'}, status=500)
+
+    return JsonResponse({
+        'error': 0,
+        "project_name": project.name,
+        **summary
+    }, status=200)
 
 
 @csrf_exempt
@@ -292,7 +417,7 @@ def add_raw_nodes(request):
     data: typing.Dict = get_json_from_request(request)
     if isinstance(data, JsonResponse):
         return data
-    project: typing.Union[Project, JsonResponse] = get_project_from_request(data)
+    project: typing.Union[Project, JsonResponse] = get_project_from_request(data, request.user)
     if isinstance(project, JsonResponse):
         return project
 
@@ -300,48 +425,64 @@ def add_raw_nodes(request):
     if not parent_id:
         return JsonResponse({"error": "Missing active node"}, status=400)
 
-    parent: Node = Node.objects.filter(id=parent_id).first()
+    parent: Node = project.nodes.filter(id=parent_id).first()
+    if not parent:
+        return JsonResponse({"error": "Active node not found"}, status=404)
 
     text = data.get("text")
-    lines = text.split("\n")
-
-    node_types = project.get_avalaible_node_types()
-    rule = project.default_rule_type
-    x = parent.x - 1
-
-    project_nodes = project.nodes.all()
-
-    nodes_modified = set()
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        last_parent = parent
-        x += 1
-        for node_info in line.split("|"):
-            node_info = node_info.strip()
-            if not node_info:
-                continue
-            node_type, node_text = node_string_re.match(node_info).groups()
-            node_type = node_type or ""
-            node_type_entity = node_types.filter(code=node_type.strip()).first()
-            if not node_type_entity:
-                node_type_entity = node_types.first()
-            node_entity = Node.objects.create(
-                project=project,
-                content=node_text.strip(),
-                node_type=node_type_entity,
-                x=x,
-                y=last_parent.y + 1
-            )
-
-            nodes_modified.add(node_entity)
-            nodes_modified.update(place_and_move_other_nodes(node_entity, project_nodes.filter(y=node_entity.y).all()))
-
-            NodeRule.objects.create(node=node_entity, rule=rule, connected_node=last_parent)
-            last_parent = node_entity
+    if data.get("async"):
+        # Большой текст разбирается в фоне: клиент опрашивает import_job и получает тот же "update"
+        job = enqueue_import(project, parent, text, request.user)
+        return JsonResponse({"error": 0, "job_id": job.id, "status": job.status}, status=202)
+
+    nodes_modified = place_raw_nodes(project, parent, text.split("\n"))
 
     return JsonResponse({"error": 0,
-                         "update": [node.get_js_format() for node in nodes_modified]
+                         "update": nodes_js_format(nodes_modified)
                          }, status=200)
+
+
+@csrf_exempt
+@either_login_required
+def layout_project(request):
+    data: typing.Dict = get_json_from_request(request)
+    if isinstance(data, JsonResponse):
+        return data
+    project: typing.Union[Project, JsonResponse] = get_project_from_request(data, request.user)
+    if isinstance(project, JsonResponse):
+        return project
+
+    root = None
+    root_id = data.get("root")
+    if root_id:
+        root = project.nodes.filter(id=root_id).first()
+        if not root:
+            return JsonResponse({"error": "Root node not found"}, status=404)
+
+    nodes_moved = layout_nodes(project, root)
+
+    return JsonResponse({"error": 0,
+                         "update": nodes_js_format(nodes_moved)
+                         }, status=200)
+
+
+@csrf_exempt
+@either_login_required
+def import_job(request, job_id):
+    # Результат задания - узлы проекта, поэтому он доступен, только пока проект принадлежит тому же пользователю
+    job = ImportJob.objects.filter(id=job_id, owner=request.user, project__owner=request.user).first()
+    if not job:
+        return JsonResponse({'error': "No job found"}, status=404)
+
+    data = {
+        "job_id": job.id,
+        "project_id": job.project_id,
+        "status": job.status,
+        "processed": job.processed_lines,
+        "total": job.total_lines,
+    }
+    if job.status == ImportJob.FAILED:
+        return JsonResponse({"error": job.error, **data})
+    if job.status == ImportJob.DONE:
+        data["update"] = nodes_js_format(job.result)
+    return JsonResponse({"error": 0, **data})
@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'API.metrics.MetricsMiddleware',
+    'API.compression.CompressionMiddleware',
+    'API.db.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -51,6 +54,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'API.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +86,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Подключение переиспользуется запросами потока 10 минут; перед повторным использованием проверяется
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Реплика для чтения (API_DB_REPLICAS); локально - копия db.sqlite3, обновляемая manage.py sync_replica
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'db-replica.sqlite3',
+    #     'CONN_MAX_AGE': 600,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+DATABASE_ROUTERS = ['API.db.ReplicaRouter']
+
+# Кеш, общий для всех процессов сервера: в нем версия типов узлов и правил (API.registry), по которой воркеры
+# узнают, что типы изменились. Для нескольких серверов - redis или memcached
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
@@ -132,3 +158,60 @@ OAUTH2_PROVIDER = {
 }
 
 CORS_ORIGIN_ALLOW_ALL = True
+
+# Хранить готовый JSON проекта (API.models.ProjectSnapshot) и отдавать его при чтении без сборки узлов.
+# Имеет смысл, когда проекты читают намного чаще, чем сохраняют
+API_PROJECT_SNAPSHOTS = False
+
+# Проекты, в которых узлов больше этого числа, отдаются потоком (StreamingHttpResponse), чтобы не держать
+# весь JSON в памяти воркера. None - только по явному параметру ?stream=1
+API_PROJECT_STREAM_THRESHOLD = 5000
+
+# Использовать асинхронные версии читающих представлений (API.async_views). Включать при запуске через asgi.py
+API_ASYNC_VIEWS = False
+
+# Кеш проверенных OAuth-токенов (API.oauth.token_cache): время жизни записи в секундах и число записей
+API_TOKEN_CACHE_TTL = 60
+API_TOKEN_CACHE_SIZE = 10000
+
+# Адреса, с которых /api/metrics/ доступен без входа (сборщик Prometheus); по умолчанию - только сотрудникам.
+# За обратным прокси на той же машине все клиенты приходят с 127.0.0.1, поэтому его сюда добавлять нельзя
+API_METRICS_ALLOWED_IPS = []
+
+# Каталог для профилей запросов, снятых по заголовку X-Profile (API.profiling)
+API_PROFILES_DIR = BASE_DIR / 'profiles'
+
+# Лента изменений проектов (API.changes, /api/project/id/<id>/changes/). LocalBackend доставляет события
+# только внутри процесса; при нескольких воркерах - 'API.changes.RedisBackend' с API_CHANGE_FEED_REDIS_URL
+API_CHANGE_FEED_BACKEND = 'API.changes.LocalBackend'
+# Интервал комментариев-пингов и время, после которого соединение закрывается и клиент переподключается, в секундах
+API_CHANGE_FEED_HEARTBEAT = 15
+API_CHANGE_FEED_TIMEOUT = 300
+
+# Число потоков процесса для фонового импорта текста (API.jobs); задания из очереди после перезапуска
+# выполняет manage.py run_import_jobs
+API_IMPORT_WORKERS = 2
+
+# Функция кодирования JSON в ответах API (API.http.json_dumps), например 'API.http.stdlib_dumps'.
+# None - orjson, если он установлен, иначе json из стандартной библиотеки
+API_JSON_DUMPS = None
+
+# Сжатие ответов (API.compression): минимальный размер ответа в байтах и уровень zlib (1 - быстрее, 9 - меньше)
+API_COMPRESSION_MIN_SIZE = 1024
+API_COMPRESSION_LEVEL = 1
+
+# PRAGMA, выполняемые на каждом новом подключении к SQLite (API.db): WAL, чтобы чтение не ждало запись,
+# ожидание блокировки вместо ошибки "database is locked", synchronous=normal (в WAL не теряет целостность),
+# отображение файла в память и кеш страниц (отрицательное значение - в КиБ)
+API_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+# Базы из DATABASES, с которых читают представления с replica_reads (API.db.ReplicaRouter), например ['replica'].
+# После записи клиент читает из default столько секунд, чтобы увидеть свои изменения, пока реплика отстает
+API_DB_REPLICAS = []
+API_DB_REPLICA_PIN_SECONDS = 5
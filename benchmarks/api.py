@@ -0,0 +1,139 @@
+"""
+Бенчмарк горячих путей API на синтетических проектах.
+
+    python -m benchmarks.api --sizes 100 1000 5000 20000 --repeat 3 --output results.json
+
+Для каждого размера проекта измеряются время, число SQL-запросов и пиковая память (tracemalloc) для
+get_project, save_project (полное и частичное изменение), add_raw_nodes (короткая и длинная вставка
+в заполненные строки) и projects. Результаты пишутся в JSON вместе с текущим коммитом;
+два файла сравниваются через python -m benchmarks.compare.
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import typing
+
+from benchmarks import common
+
+
+def measure(request: typing.Callable, prepare: typing.Optional[typing.Callable] = None, repeat: int = 3) -> dict:
+    """
+    Выполняет request repeat раз и один раз под tracemalloc.
+    prepare вызывается перед каждым запуском и возвращает аргументы для request (их подготовка не измеряется).
+    Тело ответа читается внутри замеров: потоковый ответ строится по мере чтения.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings, queries, size, streaming = [], 0, 0, False
+    for _ in range(repeat):
+        args = prepare() if prepare else ()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request(*args)
+            body = common.response_body(response)
+            timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, body[:200]
+        queries = len(captured.captured_queries)
+        size, streaming = len(body), response.streaming
+
+    args = prepare() if prepare else ()
+    tracemalloc.start()
+    common.response_body(request(*args))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds_median': round(statistics.median(timings), 5),
+        'seconds_min': round(min(timings), 5),
+        'queries': queries,
+        'peak_memory_bytes': peak,
+        'response_bytes': size,
+        'streaming': streaming,
+    }
+
+
+def run_size(client, owner, size: int, args) -> dict:
+    project = common.make_project(owner, size, args.rule_fanout, seed=size)
+    project_url = f'/api/project/id/{project.id}/'
+    results = {}
+
+    results['get_project'] = measure(lambda: client.get(project_url), repeat=args.repeat)
+    results['projects'] = measure(lambda: client.get('/api/projects/'), repeat=args.repeat)
+
+    def save(nodes):
+        return client.post('/api/project/save/', json.dumps({'project_id': project.id, 'nodes': nodes}),
+                           content_type='application/json')
+
+    saves = itertools.count()
+
+    def changed_nodes(share: float) -> tuple:
+        # Каждый запуск меняет текст у доли share узлов, чтобы сохранение не было пустым
+        nodes = json.loads(common.response_body(client.get(project_url)))['nodes']
+        step = max(1, round(1 / share))
+        version = next(saves)
+        for node in nodes[::step]:
+            node['content'] = f'Изменено {version}'
+        return (nodes,)
+
+    results['save_project_full'] = measure(save, lambda: changed_nodes(1), repeat=args.repeat)
+    results['save_project_partial'] = measure(save, lambda: changed_nodes(0.01), repeat=args.repeat)
+
+    def add_raw_nodes(lines: int):
+        # Вставка под первый узел: все строки ниже уже заполнены, узлы будут сдвигаться
+        text = '\n'.join(f'<nodeTypea>Строка {i}|<nodeTypeb>Ответ {i}' for i in range(lines))
+        return client.post('/api/project/add_raw_nodes/', json.dumps({
+            'project_id': project.id,
+            'active_node': project.nodes.order_by('id').values_list('id', flat=True).first(),
+            'text': text,
+        }), content_type='application/json')
+
+    results['add_raw_nodes_short'] = measure(lambda: add_raw_nodes(3), repeat=args.repeat)
+    results['add_raw_nodes_long'] = measure(lambda: add_raw_nodes(args.long_paste), repeat=args.repeat)
+    return results
+
+
+def git_revision() -> typing.Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--rule-fanout', type=float, default=1.5, help='среднее число правил на узел')
+    parser.add_argument('--node-types', type=int, default=4)
+    parser.add_argument('--rule-types', type=int, default=3)
+    parser.add_argument('--long-paste', type=int, default=500, help='число строк в длинной вставке')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='файл для JSON с результатами')
+    args = parser.parse_args()
+
+    common.setup(fresh=True)
+    from django.test import Client
+
+    common.ensure_types(args.node_types, args.rule_types)
+    owner = common.get_user()
+    client = Client()
+    client.force_login(owner)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'sizes': {},
+    }
+    for size in args.sizes:
+        results['sizes'][str(size)] = run_size(client, owner, size, args)
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
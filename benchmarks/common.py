@@ -0,0 +1,112 @@
+"""Общие части бенчмарков: подготовка базы и генератор синтетических проектов."""
+import json
+import os
+import random
+import sys
+import typing
+
+
+def setup(fresh: bool = False):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    from django.conf import settings
+
+    if fresh and os.path.exists(settings.DATABASES['default']['NAME']):
+        os.remove(settings.DATABASES['default']['NAME'])
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def ensure_types(node_types: int = 4, rule_types: int = 3):
+    from API.models import NodeType, RuleType
+
+    for i in range(node_types):
+        code = 'nodeType' + 'abcdefghijklmnopqrstuvwxyz'[i]
+        NodeType.objects.get_or_create(code=code, defaults={'name': code, 'color': '#FFF'})
+    RuleType.objects.get_or_create(code='mustHave', defaults={'name': 'mustHave'})
+    for i in range(rule_types - 1):
+        code = 'ruleType' + 'abcdefghijklmnopqrstuvwxyz'[i]
+        RuleType.objects.get_or_create(code=code, defaults={'name': code})
+
+
+def get_user(username: str = 'benchmark'):
+    from users.models import User
+
+    user, _ = User.objects.get_or_create(username=username)
+    return user
+
+
+def make_project(owner, nodes: int, rule_fanout: float = 1.5, name: typing.Optional[str] = None,
+                 width: int = 40, seed: int = 0):
+    """
+    Создает проект из nodes узлов, разложенных по сетке шириной width.
+    Каждый узел (кроме первого) связан с одним узлом строкой выше и в среднем с rule_fanout - 1
+    случайными узлами выше него; типы узлов и правил выбираются случайно.
+    """
+    from API.models import Project, Node, NodeRule, NodeType, RuleType
+
+    rnd = random.Random(seed)
+    node_types = list(NodeType.objects.values_list('id', flat=True))
+    rule_types = list(RuleType.objects.values_list('id', flat=True))
+
+    project = Project.objects.create(name=name or f'benchmark-{nodes}-{seed}', owner=owner)
+    created = Node.objects.bulk_create([
+        Node(
+            project=project,
+            node_type_id=rnd.choice(node_types),
+            content=f'Реплика {i} ' + 'текст ' * rnd.randint(1, 12),
+            x=i % width + 1,
+            y=i // width + 1,
+        )
+        for i in range(nodes)
+    ], batch_size=2000)
+
+    rules = {}
+    for i in range(1, nodes):
+        parent = rnd.randrange(max(0, i - width - i % width), i) if i >= width else rnd.randrange(0, i)
+        rules[(created[i].id, created[parent].id)] = rnd.choice(rule_types)
+        extra = rule_fanout - 1
+        while extra > 0 and rnd.random() < extra:
+            rules[(created[i].id, created[rnd.randrange(0, i)].id)] = rnd.choice(rule_types)
+            extra -= 1
+    NodeRule.objects.bulk_create([
+        NodeRule(node_id=node_id, connected_node_id=connected_node_id, rule_id=rule_id)
+        for (node_id, connected_node_id), rule_id in rules.items()
+    ], batch_size=2000)
+    return project
+
+
+def login_cookies(user) -> dict:
+    from django.test import Client
+
+    client = Client()
+    client.force_login(user)
+    return {key: morsel.value for key, morsel in client.cookies.items()}
+
+
+def response_body(response) -> bytes:
+    """
+    Тело ответа тестового клиента; потоковый ответ (большие проекты) читается целиком.
+    Асинхронные представления (BENCHMARK_ASYNC_VIEWS) отдают поток асинхронным итератором.
+    """
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        from asgiref.sync import async_to_sync
+
+        async def read() -> bytes:
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        return async_to_sync(read)()
+    return b''.join(response.streaming_content)
+
+
+def write_results(results, output: typing.Optional[str]):
+    data = json.dumps(results, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(data)
+    else:
+        sys.stdout.write(data + '\n')
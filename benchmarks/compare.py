@@ -0,0 +1,37 @@
+"""
+Сравнение двух результатов python -m benchmarks.api.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ('seconds_median', 'queries', 'peak_memory_bytes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before, encoding='utf-8') as file:
+        before = json.load(file)
+    with open(args.after, encoding='utf-8') as file:
+        after = json.load(file)
+
+    print(f"{'size':>6} {'path':<22} " + ' '.join(f'{metric:>28}' for metric in METRICS))
+    for size, paths in after['sizes'].items():
+        for path, result in paths.items():
+            old = before['sizes'].get(size, {}).get(path)
+            if not old:
+                continue
+            columns = []
+            for metric in METRICS:
+                ratio = result[metric] / old[metric] if old[metric] else float('nan')
+                columns.append(f'{old[metric]:>10} -> {result[metric]:>10} x{ratio:.2f}')
+            print(f'{size:>6} {path:<22} ' + ' '.join(f'{column:>28}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Сравнение пропускной способности загрузки проектов при конкурентных запросах под WSGI и ASGI.
+
+    python -m benchmarks.concurrency --nodes 2000 --concurrency 32 --requests 256
+
+WSGI: синхронные представления, запросы из пула потоков (как у многопоточного WSGI-сервера).
+ASGI: асинхронные представления API.async_views, запросы из одного цикла событий.
+Каждый режим запускается в отдельном процессе; результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import common
+
+URLS = ('/api/projects/', '/api/project/id/{project_id}/')
+
+
+def prepare(args) -> dict:
+    common.setup(fresh=True)
+    common.ensure_types()
+    user = common.get_user()
+    project = common.make_project(user, args.nodes, args.rule_fanout)
+    return {'cookies': common.login_cookies(user), 'project_id': project.id}
+
+
+def run_wsgi(args, state) -> float:
+    from django.test import Client
+
+    def load(url):
+        client = Client()
+        client.cookies.load(state['cookies'])
+        assert client.get(url).status_code == 200
+
+    urls = [URLS[i % len(URLS)].format(**state) for i in range(args.requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(load, urls))
+    return time.perf_counter() - started
+
+
+def run_asgi(args, state) -> float:
+    from django.test import AsyncClient
+
+    async def main():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def load(url):
+            async with semaphore:
+                client = AsyncClient()
+                client.cookies.load(state['cookies'])
+                response = await client.get(url)
+                assert response.status_code == 200
+
+        await asyncio.gather(*(load(URLS[i % len(URLS)].format(**state)) for i in range(args.requests)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return time.perf_counter() - started
+
+
+def run_mode(args):
+    common.setup()
+    state = json.loads(os.environ['BENCHMARK_STATE'])
+    elapsed = (run_asgi if args.mode == 'asgi' else run_wsgi)(args, state)
+    print(json.dumps({
+        'mode': args.mode,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(args.requests / elapsed, 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=2000)
+    parser.add_argument('--rule-fanout', type=float, default=1.5)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--output', help='файл для JSON с результатами')
+    parser.add_argument('--mode', choices=('wsgi', 'asgi'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args)
+
+    env = dict(os.environ, BENCHMARK_STATE=json.dumps(prepare(args)))
+    results = {'nodes': args.nodes, 'rule_fanout': args.rule_fanout}
+    for mode in ('wsgi', 'asgi'):
+        mode_env = dict(env, BENCHMARK_ASYNC_VIEWS='1' if mode == 'asgi' else '')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.concurrency', '--mode', mode] + sys.argv[1:],
+            env=mode_env, check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
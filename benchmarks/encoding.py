@@ -0,0 +1,105 @@
+"""
+Бенчмарк кодирования и сжатия ответа get_project на синтетических проектах.
+
+    python -m benchmarks.encoding --sizes 1000 5000 20000 --repeat 5 --output encoding.json
+
+Для каждого размера проекта измеряются время и размер JSON от API.http.stdlib_dumps и orjson_dumps (если orjson
+установлен), время и размер сжатия gzip и deflate на разных уровнях, а также ответ get_project целиком
+без сжатия и с Accept-Encoding: gzip (размер на проводе и время запроса).
+"""
+import argparse
+import platform
+import statistics
+import time
+import typing
+import zlib
+
+from benchmarks import common
+from benchmarks.api import git_revision
+
+
+def timed(func: typing.Callable, repeat: int) -> typing.Tuple[float, typing.Any]:
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings), 5), result
+
+
+def run_size(client, owner, size: int, args) -> dict:
+    from API.compression import CODINGS
+    from API.http import stdlib_dumps, orjson_dumps, orjson
+
+    project = common.make_project(owner, size, seed=size)
+    data = project.get_js_format()
+    results = {'encode': {}, 'compress': {}, 'response': {}}
+
+    encoders = {'stdlib': stdlib_dumps}
+    if orjson:
+        encoders['orjson'] = orjson_dumps
+    content = b''
+    for name, dumps in encoders.items():
+        seconds, content = timed(lambda: dumps(data), args.repeat)
+        results['encode'][name] = {'seconds_median': seconds, 'bytes': len(content)}
+
+    for coding, wbits in CODINGS.items():
+        for level in args.levels:
+            def compress():
+                compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+                return compressor.compress(content) + compressor.flush()
+
+            seconds, compressed = timed(compress, args.repeat)
+            results['compress'][f'{coding}-{level}'] = {
+                'seconds_median': seconds,
+                'bytes': len(compressed),
+                'ratio': round(len(content) / len(compressed), 2),
+            }
+
+    def get(headers: dict):
+        # Потоковый ответ (большие проекты) читается целиком, чтобы время включало кодирование и сжатие
+        response = client.get(f'/api/project/id/{project.id}/', **headers)
+        assert response.status_code == 200
+        body = common.response_body(response)
+        return response, body
+
+    for name, headers in (('identity', {}), ('gzip', {'HTTP_ACCEPT_ENCODING': 'gzip'})):
+        seconds, (response, body) = timed(lambda: get(headers), args.repeat)
+        results['response'][name] = {
+            'seconds_median': seconds,
+            'bytes': len(body),
+            'streaming': response.streaming,
+            'server_timing': response.get('Server-Timing'),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 3, 6, 9], help='уровни zlib')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='файл для JSON с результатами')
+    args = parser.parse_args()
+
+    common.setup(fresh=True)
+    from django.test import Client
+
+    common.ensure_types()
+    owner = common.get_user()
+    client = Client()
+    client.force_login(owner)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'sizes': {},
+    }
+    for size in args.sizes:
+        results['sizes'][str(size)] = run_size(client, owner, size, args)
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
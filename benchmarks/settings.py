@@ -0,0 +1,18 @@
+"""Настройки для бенчмарков: отдельная SQLite база, схема создается без миграций."""
+import os
+import tempfile
+
+from DialobildBackend.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DB', os.path.join(tempfile.gettempdir(), 'dialobild-benchmark.sqlite3')),
+    }
+}
+MIGRATION_MODULES = {'API': None, 'users': None, 'frontend': None}
+
+API_ASYNC_VIEWS = bool(os.environ.get('BENCHMARK_ASYNC_VIEWS'))
@@ -0,0 +1,66 @@
+"""
+Собранные файлы редактора (React) с хешем содержимого в имени.
+
+update-frontend-part.py кладет их в static/frontend/ вместе с manifest.json: исходное имя -> имя с хешем
+и сжатыми копиями рядом (.br, .gz). Шаблон получает адрес файла тегом {% asset %}, а отдает файлы
+представление frontend.views.asset: такие файлы не меняются, поэтому кешируются браузером навсегда.
+"""
+import json
+import os
+import threading
+import typing
+from pathlib import Path
+
+from django.urls import reverse
+
+ASSETS_DIR = Path(__file__).resolve().parent / 'static' / 'frontend'
+MANIFEST_NAME = 'manifest.json'
+
+# Сжатые копии файла в порядке предпочтения: расширение и значение Content-Encoding
+PRECOMPRESSED = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+class Manifest:
+    """manifest.json, перечитываемый при изменении файла, чтобы новая сборка подхватывалась без перезапуска"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: typing.Optional[float] = None
+        self._assets: typing.Dict[str, str] = {}
+        self._hashed: typing.FrozenSet[str] = frozenset()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime is None:
+                assets, previous = {}, []
+            else:
+                with open(self.path, encoding='utf-8') as file:
+                    data = json.load(file)
+                assets, previous = data['assets'], data.get('previous', [])
+            self._assets = assets
+            # Файлы предыдущей сборки нужны вкладкам, открытым до обновления
+            self._hashed = frozenset(assets.values()) | frozenset(previous)
+            self._mtime = mtime
+
+    def resolve(self, name: str) -> str:
+        """Имя файла с хешем; без сборки - исходное имя"""
+        self._load()
+        return self._assets.get(name, name)
+
+    def is_hashed(self, name: str) -> bool:
+        self._load()
+        return name in self._hashed
+
+
+manifest = Manifest(ASSETS_DIR / MANIFEST_NAME)
+
+
+def asset_url(name: str) -> str:
+    return reverse('asset', kwargs={'path': manifest.resolve(name)})
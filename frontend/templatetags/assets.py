@@ -0,0 +1,11 @@
+from django import template
+
+from frontend.assets import asset_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset(name: str) -> str:
+    """Адрес собранного файла редактора, например {% asset 'js/dialobild-app.js' %}"""
+    return asset_url(name)
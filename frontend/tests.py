@@ -1,3 +1,110 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from frontend.assets import Manifest, asset_url
+
+spec = importlib.util.spec_from_file_location(
+    'update_frontend_part', Path(__file__).resolve().parent / 'update-frontend-part.py')
+update_frontend_part = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(update_frontend_part)
+
+
+class AssetsTestCase(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.static_dir = self.root / 'static'
+        self.manifest = Manifest(self.static_dir / 'manifest.json')
+        for target, value in (('frontend.views.ASSETS_DIR', self.static_dir),
+                              ('frontend.views.manifest', self.manifest),
+                              ('frontend.assets.manifest', self.manifest)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self, files: dict) -> dict:
+        """Сборка webpack с файлами files (путь в build/static -> содержимое) и ее публикация"""
+        build_dir = self.root / 'build'
+        for name, content in files.items():
+            path = build_dir / 'static' / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+        manifest = update_frontend_part.publish(str(build_dir), str(self.static_dir))
+        for name in files:
+            os.remove(build_dir / 'static' / name)
+        # Новая сборка в пределах разрешения mtime файловой системы
+        self.manifest._mtime = None
+        return manifest
+
+
+class PublishTests(AssetsTestCase):
+    def test_entry_gets_content_hash_and_chunks_keep_names(self):
+        manifest = self.build({'js/main.1234abcd.js': b'app' * 1000, 'js/787.89abcdef.chunk.js': b'chunk'})
+
+        entry = manifest['assets']['js/dialobild-app.js']
+        self.assertRegex(entry, r'^js/dialobild-app\.[0-9a-f]{12}\.js$')
+        self.assertEqual(manifest['assets']['js/787.chunk.js'], 'js/787.89abcdef.chunk.js')
+        self.assertEqual(gzip.decompress((self.static_dir / (entry + '.gz')).read_bytes()), b'app' * 1000)
+        # Маленькие файлы не сжимаются
+        self.assertFalse((self.static_dir / 'js/787.89abcdef.chunk.js.gz').exists())
+
+    def test_keeps_previous_build_only(self):
+        first = self.build({'js/main.1111aaaa.js': b'first'})['assets']['js/dialobild-app.js']
+        second = self.build({'js/main.2222bbbb.js': b'second'})['assets']['js/dialobild-app.js']
+        manifest = self.build({'js/main.3333cccc.js': b'third'})
+
+        self.assertEqual(manifest['previous'], [second])
+        self.assertFalse((self.static_dir / first).exists())
+        self.assertTrue((self.static_dir / second).exists())
+        self.assertTrue(self.manifest.is_hashed(second))
+        self.assertFalse(self.manifest.is_hashed(first))
+
+
+class AssetViewTests(AssetsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.entry = self.build({'js/main.1234abcd.js': b'app' * 1000})['assets']['js/dialobild-app.js']
+        # brotli может быть не установлен: копия .br пишется вручную
+        (self.static_dir / (self.entry + '.br')).write_bytes(b'brotli')
+
+    def get(self, path: str, accept_encoding: str = ''):
+        return self.client.get(f'/assets/{path}', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_resolves_names_through_manifest(self):
+        self.assertEqual(asset_url('js/dialobild-app.js'), f'/assets/{self.entry}')
+        self.assertEqual(asset_url('js/unknown.js'), '/assets/js/unknown.js')
+        self.assertIn(f'/assets/{self.entry}', self.client.get('/').content.decode())
+
+    def test_serves_precompressed_copy_by_accept_encoding(self):
+        for accept_encoding, coding, content in (
+            ('gzip, br', 'br', b'brotli'),
+            ('gzip, br;q=0', 'gzip', gzip.compress(b'app' * 1000, compresslevel=9, mtime=0)),
+            ('', None, b'app' * 1000),
+            # Сжатой копии для deflate нет, а на лету файлы не сжимаются (API.compression)
+            ('deflate', None, b'app' * 1000),
+        ):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get(self.entry, accept_encoding)
+
+                self.assertEqual(response.get('Content-Encoding'), coding)
+                self.assertEqual(b''.join(response.streaming_content), content)
+                self.assertEqual(response['Content-Type'], 'text/javascript')
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_only_hashed_files_are_immutable(self):
+        (self.static_dir / 'js' / 'plain.js').write_bytes(b'plain')
+
+        self.assertIn('immutable', self.get(self.entry)['Cache-Control'])
+        self.assertEqual(self.get('js/plain.js')['Cache-Control'], 'no-cache')
+
+    def test_rejects_missing_and_outside_files(self):
+        self.assertEqual(self.get('js/missing.js').status_code, 404)
+        (self.root / 'secret.txt').write_bytes(b'secret')
+        self.assertEqual(self.get('../secret.txt').status_code, 400)
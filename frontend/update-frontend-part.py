@@ -1,22 +1,111 @@
-import os
+"""
+Сборка редактора (npm run build в Dialobild-Frontend) и публикация в static/frontend/.
+
+Каждый файл получает хеш содержимого в имени (main.*.js -> js/dialobild-app.<хеш>.js) и сжатые копии рядом:
+.gz всегда, .br - если установлен пакет brotli. Соответствие имен записывается в static/frontend/manifest.json,
+по нему шаблон подставляет адреса (frontend.assets). Файлы предыдущей сборки остаются для открытых вкладок,
+более старые удаляются.
+
+    python update-frontend-part.py [--skip-build]
+"""
+import argparse
 import glob
-import shutil
+import gzip
+import hashlib
+import json
+import os
+import re
+import typing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Имя входного бандла (main.*) в static/frontend
+ENTRY_NAME = 'dialobild-app'
+# Файлы меньше этого размера не сжимаются: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 1024
+build_hash_re = re.compile(r'\.[0-9a-f]{8,}(?=\.)')
+
+
+def asset_names(kind: str, file_name: str, content: bytes) -> typing.Tuple[str, str]:
+    """
+    Имя файла сборки в манифесте и в static/frontend. Входной бандл получает хеш своего содержимого;
+    части (chunk) webpack загружает по имени из сборки, в котором его хеш уже есть, поэтому они не переименовываются.
+    """
+    base, extension = os.path.splitext(build_hash_re.sub('', file_name, count=1))
+    if base != 'main':
+        return f'{kind}/{base}{extension}', f'{kind}/{file_name}'
+    return f'{kind}/{ENTRY_NAME}{extension}', \
+        f'{kind}/{ENTRY_NAME}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+
+def write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def write_compressed(path: str, content: bytes):
+    if len(content) < MIN_COMPRESS_SIZE:
+        return
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    for extension, compressed in variants:
+        if len(compressed) < len(content):
+            write_file(path + extension, compressed)
+
+
+def remove_file(path: str):
+    for variant in (path, path + '.gz', path + '.br'):
+        if os.path.exists(variant):
+            os.remove(variant)
+
+
+def publish(build_dir: str, static_dir: str) -> dict:
+    manifest_path = os.path.join(static_dir, 'manifest.json')
+    old_manifest = {'assets': {}, 'previous': []}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as file:
+            old_manifest = json.load(file)
+
+    assets = {}
+    for kind in ('js', 'css'):
+        for source in sorted(glob.glob(os.path.join(build_dir, 'static', kind, f'*.{kind}'))):
+            with open(source, 'rb') as file:
+                content = file.read()
+            name, target = asset_names(kind, os.path.basename(source), content)
+            write_file(os.path.join(static_dir, target), content)
+            write_compressed(os.path.join(static_dir, target), content)
+            assets[name] = target
+
+    current = set(assets.values())
+    previous = sorted(set(old_manifest['assets'].values()) - current)
+    for stale in set(old_manifest.get('previous', [])) - current - set(previous):
+        remove_file(os.path.join(static_dir, stale))
 
-# Запускаем npm run build в директории Dialobild-Frontend
-if os.path.basename(os.getcwd()) != 'Dialobild-Frontend':
-    os.chdir('Dialobild-Frontend')
-os.system('npm run build')
+    manifest = {'assets': assets, 'previous': previous}
+    # Манифест пишется последним и заменяется атомарно: шаблон не увидит ссылок на еще не записанные файлы
+    write_file(manifest_path + '.tmp', json.dumps(manifest, indent=2).encode())
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
 
-# Получаем список файлов в директории
-js_files = glob.glob('build/static/js/*.js')
 
-# Копируем файлы в нужную директорию
-for file in js_files:
-    shutil.copy(file, '../static/frontend/js/dialobild-app.js')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Собирает редактор и публикует файлы с хешем в static/frontend')
+    parser.add_argument('--skip-build', action='store_true', help='Не запускать npm run build, взять готовый build/')
+    args = parser.parse_args()
 
-# Получаем список файлов в директории
-css_files = glob.glob('build/static/css/*.css')
+    frontend_dir = os.path.dirname(os.path.abspath(__file__))
+    source_dir = os.path.join(frontend_dir, 'Dialobild-Frontend')
+    if not args.skip_build:
+        if os.system(f'cd "{source_dir}" && npm run build'):
+            raise SystemExit('npm run build failed')
 
-# Копируем файлы в нужную директорию
-for file in js_files:
-    shutil.copy(file, '../static/frontend/css/dialobild-app.css')
\ No newline at end of file
+    result = publish(os.path.join(source_dir, 'build'), os.path.join(frontend_dir, 'static', 'frontend'))
+    for name, target in result['assets'].items():
+        print(f'{name} -> {target}')
+    if brotli is None:
+        print('brotli is not installed, .br files were not created')
@@ -5,4 +5,5 @@ from . import views
 urlpatterns = [
     path('', views.app, name='app'),
     path('projects/<int:project_id>/', views.app, name='app'),
+    path('assets/<path:path>', views.asset, name='asset'),
 ]
@@ -1,6 +1,50 @@
-from django.http import JsonResponse
+import mimetypes
+import os
+
+from django.http import FileResponse, Http404
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+
+from API.compression import parse_accept_encoding, coding_weight
+from frontend.assets import ASSETS_DIR, PRECOMPRESSED, manifest
+
+# Файлы с хешем в имени не меняются: браузер не перепроверяет их весь срок кеша
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 
 # Create your views here.
 def app(request, project_id=None):
-    return render(request, "frontend/dialobild-app.html")
\ No newline at end of file
+    return render(request, "frontend/dialobild-app.html")
+
+
+@require_safe
+def asset(request, path):
+    """Файл сборки; из сжатых копий выбирается та, которую принимает браузер (Accept-Encoding)"""
+    # Путь за пределами каталога сборки - SuspiciousFileOperation (ответ 400)
+    full_path = safe_join(ASSETS_DIR, path)
+    weights = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+
+    content_encoding = None
+    for extension, coding in PRECOMPRESSED:
+        if coding_weight(weights, coding) > 0:
+            try:
+                file = open(full_path + extension, 'rb')
+            except OSError:
+                continue
+            content_encoding = coding
+            break
+    else:
+        try:
+            file = open(full_path, 'rb')
+        except OSError:
+            raise Http404
+
+    response = FileResponse(file, filename=os.path.basename(path),
+                            content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if manifest.is_hashed(path) else 'no-cache'
+    return response